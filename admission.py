@@ -0,0 +1,161 @@
+import asyncio
+import collections
+import math
+import os
+from typing import Deque, Dict, List, Optional, Tuple
+
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+# 请求分类：上传照片（ingest）、分析与批量写入（analyze）、查询（read），各类独立限制并发数与排队长度，
+# 超出排队长度或排队超时的请求直接返回429，避免上传、分析与统计查询互相拖慢。
+# 限制在每个工作进程内独立生效，多进程部署时总并发为工作进程数乘以该值
+ingest_class: str = "ingest"
+analyze_class: str = "analyze"
+read_class: str = "read"
+# 计算Retry-After时服务耗时的平滑系数
+service_time_smoothing: float = 0.2
+
+
+class AdmissionLimiter(object):
+    def __init__(self,
+                 name: str,
+                 max_concurrency: int,
+                 max_queue: int,
+                 queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        # 允许排队等待的请求数，0表示没有空闲名额时直接拒绝
+        self.max_queue = max_queue
+        # 排队等待的最长时间（秒），超时后拒绝
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.admitted_count = 0
+        self.rejected_count = 0
+        self.avg_service_ms: Optional[float] = None
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    # 只在事件循环线程中调用，不需要加锁
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.running < self.max_concurrency and len(self._waiters) == 0:
+            self.running += 1
+            self.admitted_count += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_count += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # 超时的同时刚好分配到名额
+                self.admitted_count += 1
+                return True
+            waiter.cancel()
+            self.rejected_count += 1
+            return False
+        except asyncio.CancelledError:
+            # 客户端断开连接；已分配到的名额需要交还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted_count += 1
+        return True
+
+    def release(self,
+                service_ms: Optional[float] = None):
+        if service_ms is not None:
+            self.avg_service_ms = service_ms if self.avg_service_ms is None else (
+                self.avg_service_ms + (service_ms - self.avg_service_ms) * service_time_smoothing)
+        # 并发数调小后，先减少运行数直到不超过新的限制
+        if self.running > self.max_concurrency:
+            self.running -= 1
+            return
+        # 名额直接交给最早排队且仍在等待的请求，运行数不变
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def admit_waiters(self):
+        # 并发数调大后，立即放行排队中的请求
+        while self.running < self.max_concurrency and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.running += 1
+
+    def retry_after_seconds(self) -> int:
+        # 按平均服务耗时估算当前排队清空所需的时间，至少1秒
+        if self.avg_service_ms is None:
+            return 1
+        waves = (self.queue_depth + 1) / max(1, self.max_concurrency)
+        return max(1, math.ceil(self.avg_service_ms * waves / 1000))
+
+    def snapshot(self) -> Dict:
+        return {"route_class": self.name, "max_concurrency": self.max_concurrency, "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout, "running": self.running, "queue_depth": self.queue_depth,
+                "admitted_count": self.admitted_count, "rejected_count": self.rejected_count,
+                "retry_after": self.retry_after_seconds()}
+
+
+# 默认限制：分析任务本身会处理所有未分析的照片，同一时间只运行一个，重复触发直接拒绝
+limiters: Dict[str, AdmissionLimiter] = {
+    ingest_class: AdmissionLimiter(ingest_class, max_concurrency=8, max_queue=32, queue_timeout=30),
+    analyze_class: AdmissionLimiter(analyze_class, max_concurrency=1, max_queue=0, queue_timeout=0),
+    read_class: AdmissionLimiter(read_class, max_concurrency=32, max_queue=128, queue_timeout=5),
+}
+
+# 写入与重计算类接口按(方法, 路径)匹配，其余照片与分析接口的GET请求归为查询
+_route_classes: Dict[Tuple[str, str], str] = {
+    ("POST", "/photos/upload"): ingest_class,
+    ("PUT", "/analyze/process_all"): analyze_class,
+    ("DELETE", "/photos/clear_all"): analyze_class,
+    ("PUT", "/admin/archive"): analyze_class,
+}
+_read_prefixes = ("/photos/", "/analyze/")
+
+
+def route_class(method: str,
+                path: str) -> Optional[str]:
+    # 文档、静态文件、健康检查、运维接口与CORS预检请求（OPTIONS）不受限制
+    name = _route_classes.get((method, path))
+    if name is not None:
+        return name
+    if method == "GET" and path.startswith(_read_prefixes):
+        return read_class
+    return None
+
+
+def configure(name: str,
+              max_concurrency: int,
+              max_queue: int,
+              queue_timeout: float) -> bool:
+    limiter = limiters.get(name)
+    if limiter is None:
+        return False
+    # 已在运行的请求不受影响，排队长度与超时对之后到达的请求生效
+    limiter.max_concurrency = max_concurrency
+    limiter.max_queue = max_queue
+    limiter.queue_timeout = queue_timeout
+    limiter.admit_waiters()
+    logger.info(f"请求准入限制已更新：{name}，并发数：{max_concurrency}，排队长度：{max_queue}，排队超时：{queue_timeout}秒")
+    return True
+
+
+def status_snapshot() -> List[Dict]:
+    return [limiter.snapshot() for limiter in limiters.values()]
@@ -1,15 +1,18 @@
 import os
 import random
-from typing import Tuple, List
-
-from PIL import Image
+from typing import Tuple, List, TYPE_CHECKING
 
 from hc_logger import logging as log_utils
 
+# PIL仅用于类型标注，按需导入以加快启动
+if TYPE_CHECKING:
+    from PIL import Image
+
 logger = log_utils.get_logger(os.path.basename(__file__))
 
 
 class CornPlantAnalyzeResult(object):
+    __slots__ = ('area_id', 'plant_height', 'leaf_angle', 'ears_height')
     area_id: str
     plant_height: float
     leaf_angle: float
@@ -57,7 +60,7 @@ def calculate_nearest_small_cell(x,
     return f'{nearest_column}{nearest_cell_y}'
 
 
-def analyze_photo(photo_image: Image.Image,
+def analyze_photo(photo_image: 'Image.Image',
                   longitude: float,
                   latitude: float,
                   orientation_angle: float) -> Tuple[bool, List[CornPlantAnalyzeResult]]:
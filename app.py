@@ -1,7 +1,17 @@
-from database import core as db_core
+import argparse
 
 import serve
+from hc_logger import logging as log_utils
 
 if __name__ == "__main__":
-    db_core.dbEngine.connect()
-    serve.run_server()
+    parser = argparse.ArgumentParser(description="玉米田地管理服务")
+    parser.add_argument("--production", action="store_true", help="以多进程生产模式运行")
+    parser.add_argument("--workers", type=int, default=None, help="生产模式下的工作进程数，默认与CPU核数相同")
+    parser.add_argument("--json-log", action="store_true", help="以JSON格式输出日志")
+    args = parser.parse_args()
+    if args.json_log:
+        log_utils.set_json_output(True)
+    if args.production:
+        serve.run_production_server(workers=args.workers)
+    else:
+        serve.run_server()
@@ -0,0 +1,39 @@
+import argparse
+import datetime
+import os
+from typing import List, Optional
+
+from database import core as db_core
+from database import tables
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+
+# 归档往季数据：把指定时间之前上传的照片及其玉米植株移入归档表，默认归档当前生长季之前的数据
+# 例如：python archive.py --before 2024-03-01
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="归档往季照片与玉米植株数据")
+    parser.add_argument("--before", type=datetime.datetime.fromisoformat, default=None,
+                        help="归档该时间之前上传的数据，默认为当前生长季的开始时间")
+    parser.add_argument("--batch-size", type=int, default=tables.archive_batch_size, help="每批归档的照片数量")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    cutoff = args.before if args.before is not None else tables.current_season_start()
+    db_core.dbEngine.connect()
+    try:
+        success, photo_count, corn_plant_count = tables.archive_photo_info_before(cutoff, args.batch_size)
+    finally:
+        db_core.dbEngine.engine.dispose()
+    if not success:
+        logger.error(f"归档失败，已归档照片{photo_count}张，玉米植株{corn_plant_count}株")
+        raise SystemExit(1)
+    logger.info(f"归档完成：{cutoff.isoformat()}之前的照片{photo_count}张，玉米植株{corn_plant_count}株")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from database import async_tables
+from database import core as db_core
+from database import tables
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+# 合成数据的默认参数：10x10个小区（A1~J10），每张照片约10株玉米，数据分布在一个150天的生长季内
+default_grid_columns: int = 10
+default_grid_rows: int = 10
+default_plants_per_photo: int = 10
+default_season_days: int = 150
+synthetic_season_start = datetime.datetime(2023, 4, 1)
+insert_batch_size: int = 10000
+# 冷启动（导入应用并连接数据库）的目标耗时
+default_cold_start_target_ms: float = 1500
+cold_start_runs: int = 5
+
+_cold_start_script = '''
+import sys
+import time
+start_time = time.perf_counter()
+from database import core
+import routers
+core.dbEngine.url = sys.argv[1]
+core.dbEngine.connect()
+print((time.perf_counter() - start_time) * 1000)
+'''
+
+
+def percentile(sorted_values: List[float],
+               q: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+class BenchmarkResult(object):
+    case: str
+    iterations: int
+    items: int
+    latencies_ms: List[float]
+
+    def __init__(self,
+                 case: str,
+                 iterations: int,
+                 items: int,
+                 latencies_ms: List[float]):
+        self.case = case
+        self.iterations = iterations
+        self.items = items
+        self.latencies_ms = latencies_ms
+
+    def to_dict(self) -> Dict:
+        sorted_latencies = sorted(self.latencies_ms)
+        total_seconds = sum(sorted_latencies) / 1000
+        return {"case": self.case, "iterations": self.iterations, "items": self.items,
+                "total_s": round(total_seconds, 6),
+                "ops_per_s": round(self.iterations / total_seconds, 3) if total_seconds > 0 else None,
+                "items_per_s": round(self.items / total_seconds, 3) if total_seconds > 0 else None,
+                "p50_ms": round(percentile(sorted_latencies, 0.5), 3),
+                "p99_ms": round(percentile(sorted_latencies, 0.99), 3),
+                "max_ms": round(sorted_latencies[-1], 3) if sorted_latencies else 0.0}
+
+
+def measure(case: str,
+            iterations: int,
+            func: Callable[[int], int]) -> BenchmarkResult:
+    # func接收迭代序号，返回本次处理的条目数，用于计算吞吐量
+    latencies_ms: List[float] = []
+    items = 0
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        items += func(i)
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+    return BenchmarkResult(case=case, iterations=iterations, items=items, latencies_ms=latencies_ms)
+
+
+def area_ids_of_grid(grid_columns: int,
+                     grid_rows: int) -> List[str]:
+    return [f"{chr(ord('A') + column)}{row + 1}" for column in range(grid_columns) for row in range(grid_rows)]
+
+
+def generate_synthetic_data(plant_count: int,
+                            rnd: random.Random,
+                            plants_per_photo: int = default_plants_per_photo,
+                            grid_columns: int = default_grid_columns,
+                            grid_rows: int = default_grid_rows,
+                            season_days: int = default_season_days) -> Tuple[int, int]:
+    # 直接批量写入照片与植株记录，绕过逐条插入，以便快速构造10^7级别的数据量
+    area_ids = area_ids_of_grid(grid_columns, grid_rows)
+    season_start = synthetic_season_start
+    photo_count = max(1, (plant_count + plants_per_photo - 1) // plants_per_photo)
+    session = db_core.dbEngine.new_session()
+    try:
+        first_photo_id = session.execute(select(tables.PhotoInfo.id).order_by(tables.PhotoInfo.id.desc())).scalar()
+        first_photo_id = 1 if first_photo_id is None else first_photo_id + 1
+        photo_rows: List[Dict] = []
+        plant_rows: List[Dict] = []
+        remaining_plants = plant_count
+        for photo_offset in range(photo_count):
+            taken_at = season_start + datetime.timedelta(seconds=rnd.uniform(0, season_days * 86400))
+            photo_rows.append({"id": first_photo_id + photo_offset, "longitude": rnd.uniform(0, grid_columns),
+                               "latitude": rnd.uniform(0, grid_rows), "orientation_angle": rnd.uniform(0, 360),
+                               "analyzed_at": taken_at, "created_at": taken_at, "updated_at": taken_at})
+            growth = (taken_at - season_start).total_seconds() / (season_days * 86400)
+            for _ in range(min(plants_per_photo, remaining_plants)):
+                plant_rows.append({"area_id": rnd.choice(area_ids), "photo_id": first_photo_id + photo_offset,
+                                   "plant_height": rnd.gauss(0.4 + 1.8 * growth, 0.1),
+                                   "leaf_angle": rnd.uniform(30, 60), "ears_height": rnd.gauss(0.25, 0.03),
+                                   "created_at": taken_at, "updated_at": taken_at})
+            remaining_plants -= plants_per_photo
+            if len(photo_rows) >= insert_batch_size:
+                session.execute(insert(tables.PhotoInfo), photo_rows)
+                photo_rows = []
+            if len(plant_rows) >= insert_batch_size:
+                session.execute(insert(tables.CornPlantInfo), plant_rows)
+                plant_rows = []
+        if len(photo_rows) > 0:
+            session.execute(insert(tables.PhotoInfo), photo_rows)
+        if len(plant_rows) > 0:
+            session.execute(insert(tables.CornPlantInfo), plant_rows)
+        session.commit()
+    finally:
+        session.close()
+    # 批量写入绕过了增量汇总，需要重建
+    tables.rebuild_corn_plant_rollup()
+    return photo_count, plant_count
+
+
+def naive_area_distributions() -> int:
+    # 对照组：逐个小区查询测量值，再分别计算分位数与直方图
+    import numpy as np
+    import stat_distribution
+
+    session = db_core.dbEngine.new_session(readonly=True)
+    try:
+        area_ids = [row[0] for row in session.execute(select(tables.CornPlantInfo.area_id).distinct())]
+        for area_id in area_ids:
+            rows = session.execute(select(tables.CornPlantInfo.plant_height, tables.CornPlantInfo.leaf_angle,
+                                          tables.CornPlantInfo.ears_height).where(
+                tables.CornPlantInfo.area_id == area_id)).all()
+            for values in zip(*rows):
+                values = np.array(values, dtype=np.float64)
+                values = values[~np.isnan(values)]
+                np.percentile(values, [level * 100 for level in stat_distribution.quantile_levels])
+                np.histogram(values, bins=stat_distribution.histogram_bin_count)
+        return len(area_ids)
+    finally:
+        session.close()
+
+
+def bulk_area_distributions() -> int:
+    import stat_distribution
+
+    stat_distribution.clear_cache()
+    return len(stat_distribution.get_area_distributions()[2])
+
+
+def serve_rows(loop: asyncio.AbstractEventLoop,
+               read_rows: Callable) -> int:
+    # 与列表接口相同的路径：在异步会话中读取列元组，再由rows_json_response直接序列化为JSON
+    import routers
+
+    async def serve() -> int:
+        async with async_tables.read_snapshot() as snapshot:
+            success, rows = await read_rows(snapshot.session)
+        routers.rows_json_response(rows)
+        return len(rows)
+
+    return loop.run_until_complete(serve())
+
+
+def synthetic_photo(rnd: random.Random,
+                    size: int = 64):
+    from PIL import Image
+    return Image.frombytes("RGB", (size, size), rnd.randbytes(size * size * 3))
+
+
+def measure_cold_start(db_url: str,
+                       target_ms: float) -> Dict:
+    # 在新的解释器进程中测量导入应用并连接数据库的耗时，数据库结构已是最新版本
+    latencies_ms: List[float] = []
+    for _ in range(cold_start_runs):
+        output = subprocess.run([sys.executable, "-c", _cold_start_script, db_url], check=True, capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        latencies_ms.append(float(output.strip().splitlines()[-1]))
+    record = BenchmarkResult(case="cold_start", iterations=cold_start_runs, items=cold_start_runs,
+                             latencies_ms=latencies_ms).to_dict()
+    record["target_ms"] = target_ms
+    record["within_target"] = record["p50_ms"] <= target_ms
+    return record
+
+
+def run_benchmarks(plant_count: int,
+                   upload_count: int,
+                   iterations: int,
+                   seed: int,
+                   work_dir: str) -> List[Dict]:
+    import manage_photo
+    import process
+
+    rnd = random.Random(seed)
+    # analyze_photo使用全局random生成模拟结果，同样固定种子以保证可复现
+    random.seed(seed)
+    manage_photo.photo_base_dir = os.path.join(work_dir, "photos")
+    os.makedirs(manage_photo.photo_base_dir, exist_ok=True)
+
+    records: List[Dict] = []
+
+    start_time = time.perf_counter()
+    photo_count, _ = generate_synthetic_data(plant_count, rnd)
+    records.append(BenchmarkResult(case="generate", iterations=1, items=plant_count,
+                                   latencies_ms=[(time.perf_counter() - start_time) * 1000]).to_dict())
+    logger.info(f"已生成{photo_count}张照片、{plant_count}株玉米的合成数据")
+
+    photos = [synthetic_photo(rnd) for _ in range(upload_count)]
+    records.append(measure("upload", upload_count,
+                           lambda i: 1 if manage_photo.add_photo(photos[i], rnd.uniform(0, default_grid_columns),
+                                                                 rnd.uniform(0, default_grid_rows),
+                                                                 rnd.uniform(0, 360)) else 0).to_dict())
+
+    records.append(measure("process_all", 1, lambda i: process.process_all()[0]).to_dict())
+
+    records.append(measure("stat_by_area", iterations,
+                           lambda i: len(tables.stat_corn_plant_info_by_area_id()[1])).to_dict())
+    # 列表接口在事件循环中通过异步数据访问层执行，基准测试使用同一个事件循环，异步连接池在各次迭代间复用
+    loop = asyncio.new_event_loop()
+    records.append(measure("list_all", iterations,
+                           lambda i: serve_rows(loop, async_tables.list_all_corn_plant_rows)).to_dict())
+
+    records.append(measure("stat_by_area_timeseries", iterations,
+                           lambda i: len(tables.list_corn_plant_trends(bucket_count=7)[1])).to_dict())
+
+    records.append(measure("stat_distribution_naive", iterations, lambda i: naive_area_distributions()).to_dict())
+    records.append(measure("stat_distribution", iterations, lambda i: bulk_area_distributions()).to_dict())
+
+    import stat_distribution
+    records.append(measure("stat_distribution_cached", iterations,
+                           lambda i: len(stat_distribution.get_area_distributions()[2])).to_dict())
+
+    total_photo_count = photo_count + upload_count
+    records.append(measure("list_by_photo_id", iterations,
+                           lambda i: serve_rows(loop, lambda session: async_tables.list_corn_plant_rows_by_photo_id(
+                               session, photo_id=rnd.randint(1, total_photo_count)))).to_dict())
+
+    area_ids = area_ids_of_grid(default_grid_columns, default_grid_rows)
+    records.append(measure("involved_photos", iterations,
+                           lambda i: serve_rows(loop, lambda session: async_tables.list_photo_rows_by_area_id(
+                               session, area_id=rnd.choice(area_ids)))).to_dict())
+    for async_engine in [db_core.dbEngine.async_engine] + db_core.dbEngine.async_replica_engines:
+        loop.run_until_complete(async_engine.dispose())
+    loop.close()
+    return records
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="玉米田地管理服务基准测试")
+    parser.add_argument("--plants", type=int, default=1000, help="合成植株数量（10^3 ~ 10^7）")
+    parser.add_argument("--uploads", type=int, default=100, help="上传并分析的照片数量")
+    parser.add_argument("--iterations", type=int, default=20, help="每个读取用例的重复次数")
+    parser.add_argument("--seed", type=int, default=2023, help="随机种子")
+    parser.add_argument("--db-url", type=str, default=None, help="数据库地址，默认在临时目录中创建sqlite数据库")
+    parser.add_argument("--cold-start-target-ms", type=float, default=default_cold_start_target_ms,
+                        help="冷启动目标耗时（毫秒）")
+    parser.add_argument("--output", type=str, default=None, help="结果输出文件（JSON Lines），默认输出到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    with tempfile.TemporaryDirectory(prefix="farm_bench_") as work_dir:
+        db_url = args.db_url if args.db_url is not None else f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+        db_core.dbEngine.url = db_url
+        db_core.dbEngine.connect()
+        # 默认查询只统计当前生长季，将其设为合成数据所在的生长季
+        tables.active_season_start = synthetic_season_start
+        try:
+            records = run_benchmarks(plant_count=args.plants, upload_count=args.uploads, iterations=args.iterations,
+                                     seed=args.seed, work_dir=work_dir)
+        finally:
+            db_core.dbEngine.engine.dispose()
+        records.append(measure_cold_start(db_url, args.cold_start_target_ms))
+    meta = {"case": "meta", "plants": args.plants, "uploads": args.uploads, "iterations": args.iterations,
+            "seed": args.seed, "cold_start_target_ms": args.cold_start_target_ms, "python": sys.version.split()[0],
+            "started_at": started_at}
+    lines = [json.dumps(record, ensure_ascii=False) for record in [meta] + records]
+    if args.output is None:
+        print("\n".join(lines))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,2 @@
+# 导入表定义，使其注册到core.Base.metadata中
 from . import tables
-
-_ = tables.PhotoInfo()
-
-
-_ = tables.CornPlantInfo()
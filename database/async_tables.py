@@ -0,0 +1,135 @@
+import contextlib
+import datetime
+import os
+from typing import Optional, List, Tuple
+
+from sqlalchemy import delete, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from hc_logger import logging as log_utils
+from . import core
+from . import data_version
+from .tables import (PhotoInfo, CornPlantRollup, PhotoArchive, CornPlantArchive, ReadSnapshot,
+                     StatCornPlantInfoResult, CornPlantTrendResult, corn_plant_rollup_query,
+                     merge_corn_plant_rollup_rows, corn_plant_rows_query, corn_plant_rows_by_photo_id_query,
+                     photo_rows_by_area_id_query, stat_by_area_query, stat_photo_query)
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+
+# tables模块中数据访问函数的异步版本，供FastAPI路由在事件循环中直接调用
+
+async def add_photo_info(longitude: float,
+                         latitude: float,
+                         orientation_angle: float) -> Optional[int]:
+    photo_info = PhotoInfo(longitude=longitude, latitude=latitude, orientation_angle=orientation_angle)
+    try:
+        async with core.dbEngine.new_async_session() as session:
+            session.add(photo_info)
+            await session.execute(data_version.bump_statement())
+            await session.commit()
+            return photo_info.id
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+async def clear_all_photo_info() -> bool:
+    try:
+        async with core.dbEngine.new_async_session() as session:
+            await session.execute(delete(PhotoInfo))
+            await session.execute(delete(CornPlantRollup))
+            await session.execute(delete(CornPlantArchive))
+            await session.execute(delete(PhotoArchive))
+            await session.execute(data_version.bump_statement())
+            await session.commit()
+            return True
+    except Exception as e:
+        logger.error(e)
+        return False
+
+
+# 只读函数使用read_snapshot打开的会话，与数据版本号在同一主库或副本上读取，用法：
+# async with read_snapshot(min_version) as snapshot:
+#     success, rows = await list_all_corn_plant_rows(snapshot.session)
+@contextlib.asynccontextmanager
+async def read_snapshot(min_version: Optional[int] = None):
+    index = core.dbEngine.replica_index(readonly=True)
+    session = core.dbEngine.async_session_at(index)
+    try:
+        version = await data_version.read_async(session)
+        if index is not None and min_version is not None and version < min_version:
+            # 副本尚未同步到客户端已写入的版本，改读主库
+            await session.close()
+            session = core.dbEngine.async_session_at(None)
+            version = await data_version.read_async(session)
+        yield ReadSnapshot(session, version)
+    finally:
+        await session.close()
+
+
+async def stat_photo_info(session: AsyncSession,
+                          include_history: bool = False) -> Tuple[bool, int, int]:
+    try:
+        analyze_photo_count, not_analyzed_photo_count = (await session.execute(stat_photo_query(include_history))).one()
+        return True, int(analyze_photo_count), int(not_analyzed_photo_count)
+    except Exception as e:
+        logger.error(e)
+        return False, 0, 0
+
+
+async def stat_corn_plant_info_by_area_id(session: AsyncSession,
+                                          include_history: bool = False) -> Tuple[bool, List[StatCornPlantInfoResult]]:
+    try:
+        results = (await session.execute(stat_by_area_query(include_history))).all()
+        stat_result: List[StatCornPlantInfoResult] = [
+            StatCornPlantInfoResult(area_id=result[0], plant_height_avg=result[1], leaf_angle_avg=result[2],
+                                    ears_height_avg=result[3]) for result in results]
+        return True, stat_result
+    except Exception as e:
+        logger.error(e)
+        return False, []
+
+
+async def list_corn_plant_trends(session: AsyncSession,
+                                 area_id: Optional[str] = None,
+                                 start: Optional[datetime.datetime] = None,
+                                 end: Optional[datetime.datetime] = None,
+                                 bucket_count: int = 1,
+                                 include_history: bool = False) -> Tuple[bool, List[CornPlantTrendResult]]:
+    try:
+        rows = (await session.execute(corn_plant_rollup_query(area_id, start, end, include_history))).all()
+        return True, merge_corn_plant_rollup_rows(rows, bucket_count)
+    except Exception as e:
+        logger.error(e)
+        return False, []
+
+
+async def list_all_corn_plant_rows(session: AsyncSession,
+                                   include_history: bool = False) -> Tuple[bool, List[Row]]:
+    # 列表接口的快速路径：只查询列元组，由路由直接序列化为JSON
+    try:
+        return True, (await session.execute(corn_plant_rows_query(include_history))).all()
+    except Exception as e:
+        logger.error(e)
+        return False, []
+
+
+async def list_photo_rows_by_area_id(session: AsyncSession,
+                                     area_id: str,
+                                     include_history: bool = False) -> Tuple[bool, List[Row]]:
+    try:
+        return True, (await session.execute(photo_rows_by_area_id_query(area_id, include_history))).all()
+    except Exception as e:
+        logger.error(e)
+        return False, []
+
+
+async def list_corn_plant_rows_by_photo_id(session: AsyncSession,
+                                           photo_id: int,
+                                           include_history: bool = False) -> Tuple[bool, List[Row]]:
+    try:
+        return True, (await session.execute(corn_plant_rows_by_photo_id_query(photo_id, include_history))).all()
+    except Exception as e:
+        logger.error(e)
+        return False, []
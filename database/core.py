@@ -1,51 +1,317 @@
+import contextlib
+import itertools
+import os
 import threading
-from typing import List
+import time
+from typing import List, Optional, Dict, Callable
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, inspect, insert, update, event, text, Column, Integer
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
 Base = declarative_base()
 
 
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    id = Column(Integer, primary_key=True)
+    version = Column("version", Integer, nullable=False)
+
+
+# 当前代码对应的数据库结构版本，修改表结构时需要递增并通过register_migration注册迁移
+schema_version: int = 4
+# 版本号 -> 迁移函数，迁移函数接收数据库连接，将结构从上一版本升级到该版本；
+# 全新数据库在创建最新结构后同样会依次执行所有迁移，因此迁移需要可重复执行（如建表时checkfirst）
+_migrations: Dict[int, Callable] = {}
+schema_lock_name: str = "farm_manage_schema_upgrade"
+# 等待其他进程完成迁移的最长时间（秒）
+schema_lock_timeout: int = 600
+
+
+def register_migration(version: int):
+    def decorator(migration: Callable):
+        _migrations[version] = migration
+        return migration
+
+    return decorator
+
+# 同步驱动与对应的异步驱动
+_async_drivers = {"mysql+pymysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite",
+                  "sqlite+pysqlite": "sqlite+aiosqlite"}
+
+
+# SQL执行耗时的回调，参数为语句类型（select、insert等）与耗时（毫秒），由应用通过add_query_timing_hook注册
+_query_timing_hooks: List[Callable[[str, float], None]] = []
+
+
+def add_query_timing_hook(hook: Callable[[str, float], None]):
+    _query_timing_hooks.append(hook)
+
+
+def instrument_engine(engine):
+    # 记录每条SQL的执行耗时，交给已注册的回调汇总
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        if _query_timing_hooks:
+            verb = statement.lstrip().split(None, 1)[0].lower()
+            for hook in _query_timing_hooks:
+                hook(verb, elapsed_ms)
+
+
+def enable_sqlite_wal(engine):
+    # sqlite默认的回滚日志模式下，长时间的只读扫描会阻塞写入提交直到超时；WAL模式下读写互不阻塞，
+    # 该模式记录在数据库文件中，同一文件上的异步引擎同样生效
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_journal_mode(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+def to_async_url(url: str):
+    parsed_url = make_url(url)
+    return parsed_url.set(drivername=_async_drivers.get(parsed_url.drivername, parsed_url.drivername))
+
+
 class DBEngine(object):
     def __init__(self,
                  user: str,
                  password: str,
                  db_name: str,
                  host: str,
-                 echo: bool = False):
+                 echo: bool = False,
+                 url: Optional[str] = None,
+                 replica_urls: Optional[List[str]] = None):
         self.user = user
         self.password = password
         self.db_name = db_name
         self.host = host
         self.echo = echo
+        # 指定url时直接使用（例如基准测试使用的本地sqlite数据库），否则连接MySQL
+        self.url = url
+        # 只读副本，只读查询轮流分发到各副本，写入与迁移只在主库上执行；
+        # 读己之写由调用方按客户端已写入的数据版本号判断（见tables.read_snapshot）
+        self.replica_urls: List[str] = replica_urls or []
         self.engine = None
         self.Session = None
+        self.async_engine = None
+        self.AsyncSession = None
+        self.replica_engines = []
+        self.ReplicaSessions = []
+        self.async_replica_engines = []
+        self.AsyncReplicaSessions = []
+        self._replica_counter = itertools.count()
+        # 按目标（主库与各副本）统计创建的会话数，用于确认只读查询确实分发到了副本
+        self.session_counts: List[int] = [0] * (len(self.replica_urls) + 1)
         self.locker = threading.Lock()
 
+    @property
+    def database_url(self) -> str:
+        if self.url is not None:
+            return self.url
+        return f"mysql+pymysql://{self.user}:{self.password}@{self.host}/{self.db_name}?charset=utf8"
+
     def connect(self):
-        self.engine = create_engine(
-            f"mysql+pymysql://{self.user}:{self.password}@{self.host}/{self.db_name}?charset=utf8", echo=self.echo)
-        Base.metadata.create_all(self.engine)
+        self.engine = create_engine(self.database_url, echo=self.echo)
+        instrument_engine(self.engine)
+        enable_sqlite_wal(self.engine)
+        self.upgrade_schema()
         self.Session = sessionmaker(bind=self.engine)
+        # 异步引擎供FastAPI路由使用，避免阻塞事件循环；提交后不过期对象，以便在会话外读取属性
+        self.async_engine = create_async_engine(to_async_url(self.database_url), echo=self.echo)
+        instrument_engine(self.async_engine.sync_engine)
+        self.AsyncSession = async_sessionmaker(bind=self.async_engine, expire_on_commit=False)
+        self.replica_engines = []
+        self.ReplicaSessions = []
+        self.async_replica_engines = []
+        self.AsyncReplicaSessions = []
+        self.session_counts = [0] * (len(self.replica_urls) + 1)
+        for replica_url in self.replica_urls:
+            replica_engine = create_engine(replica_url, echo=self.echo)
+            instrument_engine(replica_engine)
+            enable_sqlite_wal(replica_engine)
+            self.replica_engines.append(replica_engine)
+            self.ReplicaSessions.append(sessionmaker(bind=replica_engine))
+            async_replica_engine = create_async_engine(to_async_url(replica_url), echo=self.echo)
+            instrument_engine(async_replica_engine.sync_engine)
+            self.async_replica_engines.append(async_replica_engine)
+            self.AsyncReplicaSessions.append(async_sessionmaker(bind=async_replica_engine, expire_on_commit=False))
+
+    def prepare_schema(self):
+        # 在启动多个工作进程之前升级数据库结构，工作进程启动时版本一致，只需读取一次版本号
+        self.engine = create_engine(self.database_url, echo=self.echo)
+        enable_sqlite_wal(self.engine)
+        try:
+            self.upgrade_schema()
+        finally:
+            self.engine.dispose()
+            self.engine = None
+
+    def seed_replicas(self,
+                      batch_size: int = 10000):
+        # 仅用于本地测试（例如用两个sqlite文件模拟主从）：在各副本上创建与主库相同的结构并复制主库的全部数据；
+        # 生产环境的副本由数据库自身的复制机制同步，不应调用
+        for replica_engine in self.replica_engines:
+            Base.metadata.create_all(replica_engine)
+            with self.engine.connect() as source, replica_engine.begin() as target:
+                for table in reversed(Base.metadata.sorted_tables):
+                    target.execute(table.delete())
+                for table in Base.metadata.sorted_tables:
+                    result = source.execute(table.select().execution_options(yield_per=batch_size))
+                    for partition in result.partitions():
+                        target.execute(table.insert(), [dict(row._mapping) for row in partition])
+            logger.info(f"已复制主库数据到副本：{replica_engine.url.render_as_string(hide_password=True)}")
+
+    def current_schema_version(self) -> Optional[int]:
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+        except DBAPIError:
+            return None
+
+    @contextlib.contextmanager
+    def schema_lock(self):
+        # 多个工作进程同时启动时，只允许一个进程建表与执行迁移；
+        # MySQL使用命名锁，sqlite等没有命名锁的数据库由prepare_schema在启动工作进程前完成升级
+        if self.engine.dialect.name != "mysql":
+            yield
+            return
+        with self.engine.connect() as connection:
+            acquired = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                          {"name": schema_lock_name, "timeout": schema_lock_timeout}).scalar()
+            if acquired != 1:
+                raise Exception(f"Failed to acquire schema lock {schema_lock_name}")
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": schema_lock_name})
+
+    def upgrade_schema(self):
+        # 启动时只查询一次版本号，版本一致时不再逐表检查
+        if self.current_schema_version() == schema_version:
+            return
+        with self.schema_lock():
+            # 等待锁期间其他进程可能已完成升级，重新读取版本号
+            self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        current_version = self.current_schema_version()
+        if current_version == schema_version:
+            return
+        if current_version is None:
+            inspector = inspect(self.engine)
+            if not inspector.has_table(SchemaVersion.__tablename__) and not inspector.has_table('photo'):
+                # 全新数据库，直接创建最新结构，之后的迁移只会补充初始数据
+                Base.metadata.create_all(self.engine)
+                logger.info("已创建数据库结构")
+            else:
+                # 引入版本表之前创建的数据库
+                Base.metadata.create_all(self.engine, tables=[SchemaVersion.__table__])
+            self.init_schema_version(1)
+            current_version = 1
+        if current_version > schema_version:
+            raise Exception(f"Database schema version {current_version} is newer than {schema_version}")
+        for version in range(current_version + 1, schema_version + 1):
+            with self.engine.begin() as connection:
+                _migrations[version](connection)
+                connection.execute(update(SchemaVersion).where(SchemaVersion.id == 1).values(version=version))
+            logger.info(f"数据库结构已升级到版本：{version}")
+
+    def init_schema_version(self,
+                            version: int):
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(SchemaVersion).values(id=1, version=version))
+        except IntegrityError:
+            # 多个工作进程同时启动时，版本记录可能已由其他进程写入
+            logger.info("数据库结构版本已由其他进程初始化")
+
+    def is_connected(self) -> bool:
+        return self.engine is not None
 
-    def new_session(self):
+    async def async_disconnect(self):
+        for async_engine in [self.async_engine] + self.async_replica_engines:
+            if async_engine is not None:
+                await async_engine.dispose()
+        for engine in [self.engine] + self.replica_engines:
+            if engine is not None:
+                engine.dispose()
+        self.engine = None
+        self.Session = None
+        self.async_engine = None
+        self.AsyncSession = None
+        self.replica_engines = []
+        self.ReplicaSessions = []
+        self.async_replica_engines = []
+        self.AsyncReplicaSessions = []
+
+    def replica_index(self,
+                      readonly: bool) -> Optional[int]:
+        if not readonly or len(self.replica_urls) == 0:
+            return None
+        return next(self._replica_counter) % len(self.replica_urls)
+
+    def session_at(self,
+                   index: Optional[int]):
+        # index为None时使用主库，否则使用对应的副本
         if self.Session is None:
             raise Exception("DB connection not established")
-        return self.Session()
+        self.session_counts[0 if index is None else index + 1] += 1
+        return self.Session() if index is None else self.ReplicaSessions[index]()
+
+    def async_session_at(self,
+                         index: Optional[int]):
+        if self.AsyncSession is None:
+            raise Exception("DB connection not established")
+        self.session_counts[0 if index is None else index + 1] += 1
+        return self.AsyncSession() if index is None else self.AsyncReplicaSessions[index]()
 
+    def new_session(self,
+                    readonly: bool = False):
+        return self.session_at(self.replica_index(readonly))
 
-dbEngine = DBEngine(user=u"dashuai", password=u" ", db_name=u"test", host=u"10.5.10.97")
+    def new_async_session(self,
+                          readonly: bool = False):
+        return self.async_session_at(self.replica_index(readonly))
+
+    def routing_snapshot(self) -> List[Dict]:
+        targets = [self.database_url] + self.replica_urls
+        return [{"target": make_url(url).render_as_string(hide_password=True), "replica": index > 0,
+                 "session_count": self.session_counts[index]} for index, url in enumerate(targets)]
+
+
+def replica_urls_from_env() -> List[str]:
+    return [url.strip() for url in os.environ.get("FARM_DB_REPLICA_URLS", "").split(",") if url.strip() != ""]
+
+
+# FARM_DB_URL与FARM_DB_REPLICA_URLS（逗号分隔）可覆盖默认的数据库地址，例如本地用两个sqlite文件测试读写分离（先运行python replica.py seed初始化副本）
+dbEngine = DBEngine(user=u"dashuai", password=u" ", db_name=u"test", host=u"10.5.10.97",
+                    url=os.environ.get("FARM_DB_URL"), replica_urls=replica_urls_from_env())
 
 
 def paged_find_and_count(query_model,
                          cond,
                          orders: List,
                          page_size: int = 10,
-                         page_number: int = 1):
+                         page_number: int = 1,
+                         readonly: bool = True):
     with dbEngine.locker:
-        session = dbEngine.new_session()
+        session = dbEngine.new_session(readonly=readonly)
         offset_count = page_size * (page_number - 1)
         if (not isinstance(orders, list)) or len(orders) == 0:
             orders = [None]
@@ -71,3 +337,4 @@ def paged_find_and_count(query_model,
 
         finally:
             session.close()
+
@@ -0,0 +1,84 @@
+import datetime
+import os
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import Column, Integer, BigInteger, select, update, insert
+
+from hc_logger import logging as log_utils
+from . import core
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+
+# 单调递增的数据版本号，上传、分析写入与清空时在同一事务中递增，用于ETag、缓存失效与读己之写
+class DataVersion(core.Base):
+    __tablename__ = 'data_version'
+    id = Column(Integer, primary_key=True)
+    version = Column("version", BigInteger, nullable=False, default=0)
+
+
+@core.register_migration(3)
+def _create_data_version(connection):
+    DataVersion.__table__.create(connection, checkfirst=True)
+    if connection.execute(select(DataVersion.id).where(DataVersion.id == 1)).first() is None:
+        connection.execute(insert(DataVersion).values(id=1, version=0))
+
+
+def bump_statement():
+    return update(DataVersion).where(DataVersion.id == 1).values(version=DataVersion.version + 1)
+
+
+def bump(connection):
+    connection.execute(bump_statement())
+
+
+def version_query():
+    return select(DataVersion.version).where(DataVersion.id == 1)
+
+
+# 每个工作进程记住最近一次从数据库读到的版本号，有效期内条件GET直接与其比较并返回304，不访问数据库；
+# 其他进程的写入最多延迟有效期这么长才会反映到304的判断中，请求带有更新的读己之写版本号时不使用缓存
+cache_ttl_seconds: float = 1.0
+_cached_version: Optional[Tuple[int, float]] = None
+
+
+def remember(version: int):
+    global _cached_version
+    _cached_version = (version, time.monotonic())
+
+
+def cached(min_version: Optional[int] = None) -> Optional[int]:
+    cached_version = _cached_version
+    if cached_version is None or time.monotonic() - cached_version[1] > cache_ttl_seconds:
+        return None
+    if min_version is not None and cached_version[0] < min_version:
+        return None
+    return cached_version[0]
+
+
+# 版本号与数据需要在同一个会话（同一主库或副本、同一事务）中读取，ETag与缓存才会与响应内容一致
+def read(session) -> int:
+    version = session.execute(version_query()).scalar() or 0
+    remember(version)
+    return version
+
+
+async def read_async(session) -> int:
+    version = (await session.execute(version_query())).scalar() or 0
+    remember(version)
+    return version
+
+
+async def read_primary_async() -> int:
+    # 写入之后读取主库上的版本号，返回给客户端用于读己之写
+    async with core.dbEngine.new_async_session() as session:
+        return await read_async(session)
+
+
+def etag(version: int,
+         season_start: Optional[datetime.datetime] = None) -> str:
+    # 默认只返回当前生长季数据的接口在换季时内容会变化而版本号不变，ETag中同时包含生长季的开始时间
+    if season_start is None:
+        return f'"v{version}"'
+    return f'"v{version}-s{season_start:%Y%m%d}"'
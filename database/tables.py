@@ -1,18 +1,24 @@
+import contextlib
 import datetime
 import os
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Iterable
 
-from sqlalchemy import Column, String, Float, DateTime, Integer, ForeignKey
-from sqlalchemy.sql import func, null, distinct
+from sqlalchemy import Column, String, Float, DateTime, Integer, ForeignKey, UniqueConstraint, Index
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func, null, case
 
 from hc_logger import logging as log_utils
 from . import core
+from . import data_version
 
 logger = log_utils.get_logger(os.path.basename(__file__))
 
 
 class PhotoInfo(core.Base):
     __tablename__ = 'photo'
+    # sqlite默认按表中现有的最大id分配新id，使用AUTOINCREMENT保证归档后id不会被重复使用
+    __table_args__ = (Index('ix_photo_created_at', 'created_at'), {'sqlite_autoincrement': True})
     id = Column(Integer, primary_key=True, autoincrement=True)
     longitude = Column("longitude", Float)
     latitude = Column("latitude", Float)
@@ -24,6 +30,7 @@ class PhotoInfo(core.Base):
 
 class CornPlantInfo(core.Base):
     __tablename__ = 'corn_plant'
+    __table_args__ = (Index('ix_corn_plant_created_at', 'created_at'), {'sqlite_autoincrement': True})
     id = Column(Integer, primary_key=True, autoincrement=True)
     area_id = Column("area_id", String(100))
     photo_id = Column("photo_id", Integer, ForeignKey('photo.id', ondelete="CASCADE"))
@@ -34,6 +41,231 @@ class CornPlantInfo(core.Base):
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
 
+# 往季数据的归档表，结构与线上表一致并保留原id；归档任务按批次把旧照片连同其植株一起移入
+class PhotoArchive(core.Base):
+    __tablename__ = 'photo_archive'
+    __table_args__ = (Index('ix_photo_archive_created_at', 'created_at'),)
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    longitude = Column("longitude", Float)
+    latitude = Column("latitude", Float)
+    orientation_angle = Column("orientation_angle", Float)
+    analyzed_at = Column(DateTime, default=None)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+class CornPlantArchive(core.Base):
+    __tablename__ = 'corn_plant_archive'
+    __table_args__ = (Index('ix_corn_plant_archive_photo_id', 'photo_id'),
+                      Index('ix_corn_plant_archive_area_id', 'area_id'))
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    area_id = Column("area_id", String(100))
+    photo_id = Column("photo_id", Integer)
+    plant_height = Column("plant_height", Float)
+    leaf_angle = Column("leaf_angle", Float)
+    ears_height = Column("ears_height", Float)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+@core.register_migration(4)
+def _create_archive_tables(connection):
+    for table in (PhotoInfo.__table__, CornPlantInfo.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    PhotoArchive.__table__.create(connection, checkfirst=True)
+    CornPlantArchive.__table__.create(connection, checkfirst=True)
+
+
+# 当前生长季的开始时间，查询默认只统计当前季的数据；为None时取当年1月1日，可通过FARM_SEASON_START（如2024-03-01）指定
+active_season_start: Optional[datetime.datetime] = (
+    datetime.datetime.fromisoformat(os.environ["FARM_SEASON_START"]) if os.environ.get("FARM_SEASON_START") else None)
+
+
+def current_season_start() -> datetime.datetime:
+    if active_season_start is not None:
+        return active_season_start
+    return datetime.datetime(datetime.datetime.now().year, 1, 1)
+
+
+# 按小区、按时间桶预先汇总的植株测量值，插入植株时增量维护，用于生长趋势查询
+class CornPlantRollup(core.Base):
+    __tablename__ = 'corn_plant_rollup'
+    __table_args__ = (UniqueConstraint('area_id', 'bucket_start', name='uq_corn_plant_rollup_area_bucket'),
+                      Index('ix_corn_plant_rollup_bucket_start', 'bucket_start'))
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    area_id = Column("area_id", String(100), nullable=False)
+    bucket_start = Column("bucket_start", DateTime, nullable=False)
+    plant_count = Column("plant_count", Integer, nullable=False, default=0)
+    plant_height_sum = Column("plant_height_sum", Float, nullable=False, default=0)
+    leaf_angle_sum = Column("leaf_angle_sum", Float, nullable=False, default=0)
+    ears_height_sum = Column("ears_height_sum", Float, nullable=False, default=0)
+
+
+# 汇总时间桶的长度（秒），默认按天汇总；修改后需要调用rebuild_corn_plant_rollup重建
+rollup_bucket_seconds: int = 86400
+_rollup_epoch = datetime.datetime(1970, 1, 1)
+
+
+def rollup_bucket_start(moment: datetime.datetime,
+                        bucket_seconds: Optional[int] = None) -> datetime.datetime:
+    bucket_seconds = rollup_bucket_seconds if bucket_seconds is None else bucket_seconds
+    seconds = int((moment - _rollup_epoch).total_seconds())
+    return _rollup_epoch + datetime.timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+def accumulate_corn_plant_rollup(connection,
+                                 area_id: str,
+                                 bucket_start: datetime.datetime,
+                                 plant_count: int,
+                                 plant_height_sum: float,
+                                 leaf_angle_sum: float,
+                                 ears_height_sum: float):
+    # 先原子累加已有的桶，不存在时再插入；并发插入冲突时回退为累加
+    values = {"plant_count": CornPlantRollup.plant_count + plant_count,
+              "plant_height_sum": CornPlantRollup.plant_height_sum + plant_height_sum,
+              "leaf_angle_sum": CornPlantRollup.leaf_angle_sum + leaf_angle_sum,
+              "ears_height_sum": CornPlantRollup.ears_height_sum + ears_height_sum}
+    cond = (CornPlantRollup.area_id == area_id) & (CornPlantRollup.bucket_start == bucket_start)
+    if connection.execute(update(CornPlantRollup).where(cond).values(values)).rowcount > 0:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(insert(CornPlantRollup).values(
+                area_id=area_id, bucket_start=bucket_start, plant_count=plant_count,
+                plant_height_sum=plant_height_sum, leaf_angle_sum=leaf_angle_sum, ears_height_sum=ears_height_sum))
+    except IntegrityError:
+        connection.execute(update(CornPlantRollup).where(cond).values(values))
+
+
+def rebuild_corn_plant_rollup_with_connection(connection):
+    # 流式扫描corn_plant，在内存中按(小区, 时间桶)累加后整体写入
+    sums: Dict[Tuple[str, datetime.datetime], List] = {}
+    qry = select(CornPlantInfo.area_id, CornPlantInfo.created_at, CornPlantInfo.plant_height,
+                 CornPlantInfo.leaf_angle, CornPlantInfo.ears_height)
+    for area_id, created_at, plant_height, leaf_angle, ears_height in connection.execution_options(
+            yield_per=10000).execute(qry):
+        if area_id is None or created_at is None:
+            continue
+        bucket = sums.setdefault((area_id, rollup_bucket_start(created_at)), [0, 0.0, 0.0, 0.0])
+        bucket[0] += 1
+        bucket[1] += plant_height or 0.0
+        bucket[2] += leaf_angle or 0.0
+        bucket[3] += ears_height or 0.0
+    connection.execute(delete(CornPlantRollup))
+    rows = [{"area_id": area_id, "bucket_start": bucket_start, "plant_count": bucket[0], "plant_height_sum": bucket[1],
+             "leaf_angle_sum": bucket[2], "ears_height_sum": bucket[3]} for (area_id, bucket_start), bucket in
+            sums.items()]
+    if len(rows) > 0:
+        connection.execute(insert(CornPlantRollup), rows)
+
+
+@core.register_migration(2)
+def _create_corn_plant_rollup(connection):
+    CornPlantRollup.__table__.create(connection, checkfirst=True)
+    rebuild_corn_plant_rollup_with_connection(connection)
+
+
+# 列表接口只查询这些列（顺序与对应的Result类字段一致，列标签与路由响应模型的字段同名），跳过ORM实例的构造
+corn_plant_columns = (CornPlantInfo.id.label('corn_plant_id'), CornPlantInfo.area_id, CornPlantInfo.photo_id,
+                      CornPlantInfo.plant_height, CornPlantInfo.leaf_angle, CornPlantInfo.ears_height,
+                      CornPlantInfo.created_at, CornPlantInfo.updated_at)
+photo_columns = (PhotoInfo.id.label('photo_id'), PhotoInfo.longitude, PhotoInfo.latitude, PhotoInfo.orientation_angle,
+                 PhotoInfo.analyzed_at, PhotoInfo.created_at, PhotoInfo.updated_at)
+corn_plant_archive_columns = (CornPlantArchive.id.label('corn_plant_id'), CornPlantArchive.area_id,
+                              CornPlantArchive.photo_id, CornPlantArchive.plant_height, CornPlantArchive.leaf_angle,
+                              CornPlantArchive.ears_height, CornPlantArchive.created_at, CornPlantArchive.updated_at)
+photo_archive_columns = (PhotoArchive.id.label('photo_id'), PhotoArchive.longitude, PhotoArchive.latitude,
+                         PhotoArchive.orientation_angle, PhotoArchive.analyzed_at, PhotoArchive.created_at,
+                         PhotoArchive.updated_at)
+
+
+# 以下查询默认只包含当前生长季的线上数据，include_history为True时包含线上表的全部数据与归档表
+def corn_plant_rows_query(include_history: bool = False):
+    if not include_history:
+        return select(*corn_plant_columns).where(CornPlantInfo.created_at >= current_season_start())
+    return select(*corn_plant_columns).union_all(select(*corn_plant_archive_columns))
+
+
+def corn_plant_rows_by_photo_id_query(photo_id: int,
+                                      include_history: bool = False):
+    qry = select(*corn_plant_columns).where(CornPlantInfo.photo_id == photo_id)
+    if not include_history:
+        return qry
+    return qry.union_all(select(*corn_plant_archive_columns).where(CornPlantArchive.photo_id == photo_id))
+
+
+def photo_rows_by_area_id_query(area_id: str,
+                                include_history: bool = False):
+    qry = select(*photo_columns).distinct()
+    qry = qry.join(CornPlantInfo, CornPlantInfo.photo_id == PhotoInfo.id)
+    qry = qry.where(CornPlantInfo.area_id == area_id)
+    if not include_history:
+        return qry.where(CornPlantInfo.created_at >= current_season_start())
+    archive_qry = select(*photo_archive_columns).distinct()
+    archive_qry = archive_qry.join(CornPlantArchive, CornPlantArchive.photo_id == PhotoArchive.id)
+    archive_qry = archive_qry.where(CornPlantArchive.area_id == area_id)
+    return qry.union_all(archive_qry)
+
+
+def measurement_query(include_history: bool = False):
+    # 小区编号与三项测量值
+    qry = select(CornPlantInfo.area_id, CornPlantInfo.plant_height, CornPlantInfo.leaf_angle, CornPlantInfo.ears_height)
+    qry = qry.where(CornPlantInfo.area_id.is_not(None))
+    if not include_history:
+        return qry.where(CornPlantInfo.created_at >= current_season_start())
+    archive_qry = select(CornPlantArchive.area_id, CornPlantArchive.plant_height, CornPlantArchive.leaf_angle,
+                         CornPlantArchive.ears_height).where(CornPlantArchive.area_id.is_not(None))
+    return qry.union_all(archive_qry)
+
+
+def stat_by_area_query(include_history: bool = False):
+    measurements = measurement_query(include_history).subquery()
+    qry = select(measurements.c.area_id, func.avg(measurements.c.plant_height).label('plant_height_avg'),
+                 func.avg(measurements.c.leaf_angle).label('leaf_angle_avg'),
+                 func.avg(measurements.c.ears_height).label('ears_height_avg'))
+    return qry.group_by(measurements.c.area_id)
+
+
+def stat_photo_query(include_history: bool = False):
+    # 一次查询同时统计已分析与未分析的照片数量
+    qry = select(PhotoInfo.analyzed_at)
+    if not include_history:
+        qry = qry.where(PhotoInfo.created_at >= current_season_start())
+    else:
+        qry = qry.union_all(select(PhotoArchive.analyzed_at))
+    photos = qry.subquery()
+    return select(func.coalesce(func.sum(case((photos.c.analyzed_at != null(), 1), else_=0)), 0),
+                  func.coalesce(func.sum(case((photos.c.analyzed_at == null(), 1), else_=0)), 0))
+
+
+class ReadSnapshot(object):
+    __slots__ = ('session', 'version')
+
+    def __init__(self,
+                 session,
+                 version: int):
+        self.session = session
+        self.version: int = version
+
+
+# 只读查询的会话：先在同一会话中读取数据版本号，ETag与缓存使用该版本号，与随后读取的数据一致；
+# min_version为客户端自己写入后得到的版本号，所选副本尚未同步到该版本时改读主库，保证读己之写
+@contextlib.contextmanager
+def read_snapshot(min_version: Optional[int] = None):
+    index = core.dbEngine.replica_index(readonly=True)
+    session = core.dbEngine.session_at(index)
+    try:
+        version = data_version.read(session)
+        if index is not None and min_version is not None and version < min_version:
+            session.close()
+            session = core.dbEngine.session_at(None)
+            version = data_version.read(session)
+        yield ReadSnapshot(session, version)
+    finally:
+        session.close()
+
+
 def add_photo_info(longitude: float,
                    latitude: float,
                    orientation_angle: float) -> Optional[int]:
@@ -46,6 +278,7 @@ def add_photo_info(longitude: float,
             return None
         try:
             session.add(photo_info)
+            data_version.bump(session.connection())
             session.commit()
             return photo_info.id
         except Exception as e:
@@ -60,8 +293,10 @@ def add_corn_plant_info(area_id: str,
                         plant_height: float,
                         leaf_angle: float,
                         ears_height: float) -> Optional[int]:
+    created_at = datetime.datetime.now()
     corn_plant_info = CornPlantInfo(area_id=area_id, photo_id=photo_id, plant_height=plant_height,
-                                    leaf_angle=leaf_angle, ears_height=ears_height)
+                                    leaf_angle=leaf_angle, ears_height=ears_height, created_at=created_at,
+                                    updated_at=created_at)
     with core.dbEngine.locker:
         try:
             session = core.dbEngine.new_session()
@@ -70,6 +305,13 @@ def add_corn_plant_info(area_id: str,
             return None
         try:
             session.add(corn_plant_info)
+            session.flush()
+            # 与植株记录在同一事务中更新汇总
+            accumulate_corn_plant_rollup(session.connection(), area_id=area_id,
+                                         bucket_start=rollup_bucket_start(created_at), plant_count=1,
+                                         plant_height_sum=plant_height, leaf_angle_sum=leaf_angle,
+                                         ears_height_sum=ears_height)
+            data_version.bump(session.connection())
             session.commit()
             return corn_plant_info.id
         except Exception as e:
@@ -82,7 +324,7 @@ def add_corn_plant_info(area_id: str,
 def get_photo_info(photo_id: int) -> Optional[PhotoInfo]:
     with core.dbEngine.locker:
         try:
-            session = core.dbEngine.new_session()
+            session = core.dbEngine.new_session(readonly=True)
         except Exception as e:
             logger.error(e)
             return None
@@ -108,6 +350,51 @@ def mark_photo_info_analyzed(photo_id: int) -> bool:
             if photo_info is None:
                 return False
             photo_info.analyzed_at = datetime.datetime.now()
+            data_version.bump(session.connection())
+            session.commit()
+            return True
+        except Exception as e:
+            logger.error(e)
+            return False
+        finally:
+            session.close()
+
+
+# 分析任务在处理照片前先认领：只有analyzed_at仍为空时才写入，多个工作进程或线程同时分析时每张照片只会被处理一次
+def claim_photo_info(photo_id: int) -> bool:
+    with core.dbEngine.locker:
+        try:
+            session = core.dbEngine.new_session()
+        except Exception as e:
+            logger.error(e)
+            return False
+        try:
+            result = session.execute(update(PhotoInfo).where(PhotoInfo.id == photo_id, PhotoInfo.analyzed_at == null())
+                                     .values(analyzed_at=datetime.datetime.now()))
+            if result.rowcount != 1:
+                session.rollback()
+                return False
+            data_version.bump(session.connection())
+            session.commit()
+            return True
+        except Exception as e:
+            logger.error(e)
+            return False
+        finally:
+            session.close()
+
+
+# 分析失败时交还认领，之后的分析任务可以重新处理该照片
+def release_photo_info_claim(photo_id: int) -> bool:
+    with core.dbEngine.locker:
+        try:
+            session = core.dbEngine.new_session()
+        except Exception as e:
+            logger.error(e)
+            return False
+        try:
+            session.execute(update(PhotoInfo).where(PhotoInfo.id == photo_id).values(analyzed_at=None))
+            data_version.bump(session.connection())
             session.commit()
             return True
         except Exception as e:
@@ -126,6 +413,10 @@ def clear_all_photo_info() -> bool:
             return False
         try:
             session.query(PhotoInfo).delete()
+            session.query(CornPlantRollup).delete()
+            session.query(CornPlantArchive).delete()
+            session.query(PhotoArchive).delete()
+            data_version.bump(session.connection())
             session.commit()
             return True
         except Exception as e:
@@ -135,20 +426,25 @@ def clear_all_photo_info() -> bool:
             session.close()
 
 
-def stat_photo_info() -> Tuple[bool, int, int]:
-    try:
-        analyze_photo_count, _ = core.paged_find_and_count(query_model=PhotoInfo, cond=PhotoInfo.analyzed_at != null(),
-                                                           orders=[None], page_size=0)
-        not_analyzed_photo_count, _ = core.paged_find_and_count(query_model=PhotoInfo,
-                                                                cond=PhotoInfo.analyzed_at == null(), orders=[None],
-                                                                page_size=0)
-        return True, analyze_photo_count, not_analyzed_photo_count
-    except Exception as e:
-        logger.error(e)
-        return False, 0, 0
+def stat_photo_info(include_history: bool = False) -> Tuple[bool, int, int]:
+    with core.dbEngine.locker:
+        try:
+            session = core.dbEngine.new_session(readonly=True)
+        except Exception as e:
+            logger.error(e)
+            return False, 0, 0
+        try:
+            analyze_photo_count, not_analyzed_photo_count = session.execute(stat_photo_query(include_history)).one()
+            return True, int(analyze_photo_count), int(not_analyzed_photo_count)
+        except Exception as e:
+            logger.error(e)
+            return False, 0, 0
+        finally:
+            session.close()
 
 
 class StatCornPlantInfoResult(object):
+    __slots__ = ('area_id', 'plant_height_avg', 'leaf_angle_avg', 'ears_height_avg')
     area_id: str
     plant_height_avg: float
     leaf_angle_avg: float
@@ -165,19 +461,15 @@ class StatCornPlantInfoResult(object):
         self.ears_height_avg = ears_height_avg
 
 
-def stat_corn_plant_info_by_area_id() -> Tuple[bool, List[StatCornPlantInfoResult]]:
+def stat_corn_plant_info_by_area_id(include_history: bool = False) -> Tuple[bool, List[StatCornPlantInfoResult]]:
     with core.dbEngine.locker:
         try:
-            session = core.dbEngine.new_session()
+            session = core.dbEngine.new_session(readonly=True)
         except Exception as e:
             logger.error(e)
             return False, []
         try:
-            qry = session.query(CornPlantInfo.area_id, func.avg(CornPlantInfo.plant_height).label('plant_height_avg'),
-                                func.avg(CornPlantInfo.leaf_angle).label('leaf_angle_avg'),
-                                func.avg(CornPlantInfo.ears_height).label('ears_height_avg'))
-            qry = qry.group_by(CornPlantInfo.area_id)
-            results = qry.all()
+            results = session.execute(stat_by_area_query(include_history)).all()
             stat_result: List[StatCornPlantInfoResult] = [
                 StatCornPlantInfoResult(area_id=result[0], plant_height_avg=result[1], leaf_angle_avg=result[2],
                                         ears_height_avg=result[3]) for result in results]
@@ -190,6 +482,8 @@ def stat_corn_plant_info_by_area_id() -> Tuple[bool, List[StatCornPlantInfoResul
 
 
 class CornPlantInfoResult(object):
+    __slots__ = ('corn_plant_id', 'area_id', 'photo_id', 'plant_height', 'leaf_angle', 'ears_height', 'created_at',
+                 'updated_at')
     corn_plant_id: int
     area_id: str
     photo_id: int
@@ -218,20 +512,26 @@ class CornPlantInfoResult(object):
         self.updated_at: datetime.datetime = updated_at
 
 
-def list_all_corn_plants_info() -> Tuple[bool, int, List[CornPlantInfoResult]]:
-    try:
-        count, results = core.paged_find_and_count(query_model=CornPlantInfo, cond=None, orders=[], page_size=0)
-        corn_plants = [
-            CornPlantInfoResult(area_id=result.area_id, photo_id=result.photo_id, plant_height=result.plant_height,
-                                leaf_angle=result.leaf_angle, ears_height=result.ears_height, corn_plant_id=result.id,
-                                created_at=result.created_at, updated_at=result.updated_at) for result in results]
-        return True, count, corn_plants
-    except Exception as e:
-        logger.error(e)
-        return False, 0, []
+def list_all_corn_plants_info(include_history: bool = False) -> Tuple[bool, int, List[CornPlantInfoResult]]:
+    with core.dbEngine.locker:
+        try:
+            session = core.dbEngine.new_session(readonly=True)
+        except Exception as e:
+            logger.error(e)
+            return False, 0, []
+        try:
+            rows = session.execute(corn_plant_rows_query(include_history)).all()
+            corn_plants: List[CornPlantInfoResult] = [CornPlantInfoResult(*row) for row in rows]
+            return True, len(corn_plants), corn_plants
+        except Exception as e:
+            logger.error(e)
+            return False, 0, []
+        finally:
+            session.close()
 
 
 class PhotoInfoResult(object):
+    __slots__ = ('photo_id', 'longitude', 'latitude', 'orientation_angle', 'analyzed_at', 'created_at', 'updated_at')
     photo_id: int
     longitude: float
     latitude: float
@@ -257,26 +557,17 @@ class PhotoInfoResult(object):
         self.updated_at: datetime.datetime = updated_at
 
 
-def list_photo_info_by_area_id(area_id: str) -> Tuple[bool, int, List[PhotoInfoResult]]:
+def list_photo_info_by_area_id(area_id: str,
+                               include_history: bool = False) -> Tuple[bool, int, List[PhotoInfoResult]]:
     with core.dbEngine.locker:
         try:
-            session = core.dbEngine.new_session()
+            session = core.dbEngine.new_session(readonly=True)
         except Exception as e:
             logger.error(e)
             return False, 0, []
         try:
-            query = session.query(distinct(PhotoInfo.id), PhotoInfo)
-            query = query.join(CornPlantInfo, CornPlantInfo.photo_id == PhotoInfo.id)
-            query = query.filter(CornPlantInfo.area_id == area_id)
-            query_results = query.all()
-            results: List[PhotoInfoResult] = []
-            for query_result in query_results:
-                photo_info = query_result[1]
-                results.append(PhotoInfoResult(photo_id=photo_info.id, longitude=photo_info.longitude,
-                                               latitude=photo_info.latitude,
-                                               orientation_angle=photo_info.orientation_angle,
-                                               analyzed_at=photo_info.analyzed_at, created_at=photo_info.created_at,
-                                               updated_at=photo_info.updated_at))
+            rows = session.execute(photo_rows_by_area_id_query(area_id, include_history)).all()
+            results: List[PhotoInfoResult] = [PhotoInfoResult(*row) for row in rows]
             return True, len(results), results
         except Exception as e:
             logger.error(e)
@@ -285,26 +576,156 @@ def list_photo_info_by_area_id(area_id: str) -> Tuple[bool, int, List[PhotoInfoR
             session.close()
 
 
-def list_corn_plants_info_by_photo_id(photo_id: int) -> Tuple[bool, int, List[CornPlantInfoResult]]:
+def list_corn_plants_info_by_photo_id(photo_id: int,
+                                      include_history: bool = False) -> Tuple[bool, int, List[CornPlantInfoResult]]:
     with core.dbEngine.locker:
         try:
-            session = core.dbEngine.new_session()
+            session = core.dbEngine.new_session(readonly=True)
         except Exception as e:
             logger.error(e)
             return False, 0, []
         try:
-            query = session.query(CornPlantInfo)
-            query = query.filter(CornPlantInfo.photo_id == photo_id)
-            query_results = query.all()
-            results: List[CornPlantInfoResult] = [
-                CornPlantInfoResult(area_id=query_result.area_id, photo_id=query_result.photo_id,
-                                    plant_height=query_result.plant_height, leaf_angle=query_result.leaf_angle,
-                                    ears_height=query_result.ears_height, corn_plant_id=query_result.id,
-                                    created_at=query_result.created_at, updated_at=query_result.updated_at) for
-                query_result in query_results]
+            rows = session.execute(corn_plant_rows_by_photo_id_query(photo_id, include_history)).all()
+            results: List[CornPlantInfoResult] = [CornPlantInfoResult(*row) for row in rows]
             return True, len(results), results
         except Exception as e:
             logger.error(e)
             return False, 0, []
         finally:
             session.close()
+
+
+def rebuild_corn_plant_rollup() -> bool:
+    with core.dbEngine.locker:
+        try:
+            with core.dbEngine.engine.begin() as connection:
+                rebuild_corn_plant_rollup_with_connection(connection)
+                data_version.bump(connection)
+            return True
+        except Exception as e:
+            logger.error(e)
+            return False
+
+
+# 每批归档的照片数量，每批在一个短事务中完成，避免长时间锁表
+archive_batch_size: int = 500
+
+
+def archive_photo_info_before(cutoff: datetime.datetime,
+                              batch_size: int = archive_batch_size) -> Tuple[bool, int, int]:
+    # 将cutoff之前上传的照片及其玉米植株移入归档表；汇总表保留，历史趋势不受影响
+    photo_count = 0
+    corn_plant_count = 0
+    while True:
+        with core.dbEngine.locker:
+            try:
+                with core.dbEngine.engine.begin() as connection:
+                    # 保留id最大的照片，以及id最大的植株所属的照片：未使用AUTOINCREMENT创建的sqlite表与MySQL 8.0之前的版本
+                    # （重启后）按线上表中现有的最大id分配新id，线上表被清空后会从1重新开始，
+                    # 与归档表中的id冲突，并覆盖photos目录中已归档照片的图片；保留的照片不属于当前生长季，默认查询不会返回
+                    kept_photo_ids = [photo_id for photo_id in (
+                        connection.execute(select(func.max(PhotoInfo.id))).scalar(),
+                        connection.execute(select(CornPlantInfo.photo_id).order_by(CornPlantInfo.id.desc()).limit(
+                            1)).scalar()) if photo_id is not None]
+                    qry = select(PhotoInfo.id).where(PhotoInfo.created_at < cutoff, PhotoInfo.id.not_in(kept_photo_ids))
+                    photo_ids = connection.execute(qry.order_by(PhotoInfo.id).limit(batch_size)).scalars().all()
+                    if len(photo_ids) == 0:
+                        return True, photo_count, corn_plant_count
+                    connection.execute(insert(PhotoArchive).from_select(
+                        [column.name for column in PhotoArchive.__table__.columns],
+                        select(*[getattr(PhotoInfo, column.name) for column in PhotoArchive.__table__.columns]).where(
+                            PhotoInfo.id.in_(photo_ids))))
+                    connection.execute(insert(CornPlantArchive).from_select(
+                        [column.name for column in CornPlantArchive.__table__.columns],
+                        select(*[getattr(CornPlantInfo, column.name) for column in
+                                 CornPlantArchive.__table__.columns]).where(CornPlantInfo.photo_id.in_(photo_ids))))
+                    batch_corn_plant_count = connection.execute(
+                        delete(CornPlantInfo).where(CornPlantInfo.photo_id.in_(photo_ids))).rowcount
+                    connection.execute(delete(PhotoInfo).where(PhotoInfo.id.in_(photo_ids)))
+                    data_version.bump(connection)
+            except Exception as e:
+                logger.error(e)
+                return False, photo_count, corn_plant_count
+        photo_count += len(photo_ids)
+        corn_plant_count += batch_corn_plant_count
+        logger.info(f"已归档照片{photo_count}张，玉米植株{corn_plant_count}株")
+
+
+class CornPlantTrendResult(object):
+    __slots__ = ('area_id', 'bucket_start', 'plant_count', 'plant_height_avg', 'leaf_angle_avg', 'ears_height_avg')
+    area_id: str
+    bucket_start: datetime.datetime
+    plant_count: int
+    plant_height_avg: float
+    leaf_angle_avg: float
+    ears_height_avg: float
+
+    def __init__(self,
+                 area_id: str,
+                 bucket_start: datetime.datetime,
+                 plant_count: int,
+                 plant_height_avg: float,
+                 leaf_angle_avg: float,
+                 ears_height_avg: float):
+        self.area_id: str = area_id
+        self.bucket_start: datetime.datetime = bucket_start
+        self.plant_count: int = plant_count
+        self.plant_height_avg: float = plant_height_avg
+        self.leaf_angle_avg: float = leaf_angle_avg
+        self.ears_height_avg: float = ears_height_avg
+
+
+def corn_plant_rollup_query(area_id: Optional[str],
+                            start: Optional[datetime.datetime],
+                            end: Optional[datetime.datetime],
+                            include_history: bool = False):
+    # 汇总表不归档，未指定开始时间时默认从当前生长季开始
+    if start is None and not include_history:
+        start = current_season_start()
+    qry = select(CornPlantRollup.area_id, CornPlantRollup.bucket_start, CornPlantRollup.plant_count,
+                 CornPlantRollup.plant_height_sum, CornPlantRollup.leaf_angle_sum, CornPlantRollup.ears_height_sum)
+    if area_id is not None:
+        qry = qry.where(CornPlantRollup.area_id == area_id)
+    if start is not None:
+        qry = qry.where(CornPlantRollup.bucket_start >= rollup_bucket_start(start))
+    if end is not None:
+        qry = qry.where(CornPlantRollup.bucket_start < end)
+    return qry.order_by(CornPlantRollup.area_id, CornPlantRollup.bucket_start)
+
+
+def merge_corn_plant_rollup_rows(rows: Iterable,
+                                 bucket_count: int = 1) -> List[CornPlantTrendResult]:
+    # 将相邻的bucket_count个汇总桶合并为一个数据点，rows需按(小区, 时间桶)排序
+    merged: Dict[Tuple[str, datetime.datetime], List] = {}
+    for area_id, bucket_start, plant_count, plant_height_sum, leaf_angle_sum, ears_height_sum in rows:
+        point_start = rollup_bucket_start(bucket_start, rollup_bucket_seconds * bucket_count)
+        point = merged.setdefault((area_id, point_start), [0, 0.0, 0.0, 0.0])
+        point[0] += plant_count
+        point[1] += plant_height_sum
+        point[2] += leaf_angle_sum
+        point[3] += ears_height_sum
+    return [CornPlantTrendResult(area_id=area_id, bucket_start=point_start, plant_count=point[0],
+                                 plant_height_avg=point[1] / point[0], leaf_angle_avg=point[2] / point[0],
+                                 ears_height_avg=point[3] / point[0]) for (area_id, point_start), point in
+            merged.items() if point[0] > 0]
+
+
+def list_corn_plant_trends(area_id: Optional[str] = None,
+                           start: Optional[datetime.datetime] = None,
+                           end: Optional[datetime.datetime] = None,
+                           bucket_count: int = 1,
+                           include_history: bool = False) -> Tuple[bool, List[CornPlantTrendResult]]:
+    with core.dbEngine.locker:
+        try:
+            session = core.dbEngine.new_session(readonly=True)
+        except Exception as e:
+            logger.error(e)
+            return False, []
+        try:
+            rows = session.execute(corn_plant_rollup_query(area_id, start, end, include_history)).all()
+            return True, merge_corn_plant_rollup_rows(rows, bucket_count)
+        except Exception as e:
+            logger.error(e)
+            return False, []
+        finally:
+            session.close()
@@ -1,13 +1,88 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
 import typing
 
-# 初始化日志模块
-logging.basicConfig(level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S',
-                    format='%(asctime)s.%(msecs)03d - %(levelname)s - %(name)s - line:%(lineno)d - %(message)s')
+_log_format = '%(asctime)s.%(msecs)03d - %(levelname)s - %(name)s - line:%(lineno)d - %(message)s'
+_date_format = '%Y-%m-%d %H:%M:%S'
+# 通过环境变量开启JSON格式输出，多进程模式下子进程同样生效
+json_output_env: str = 'HC_LOG_JSON'
+# 日志队列长度上限，队列满时丢弃新日志而不是阻塞调用方
+queue_max_size: int = 10000
 
 _default_level: int = logging.INFO
 
 
+class JsonFormatter(logging.Formatter):
+    def format(self,
+               record):
+        payload = {"time": f"{self.formatTime(record, _date_format)}.{int(record.msecs):03d}",
+                   "level": record.levelname, "logger": record.name, "line": record.lineno,
+                   "message": record.getMessage()}
+        # 异常堆栈已由DroppingQueueHandler在调用方线程中格式化为exc_text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self,
+                 log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped_count = 0
+
+    def prepare(self,
+                record):
+        # 默认实现会把异常堆栈并入message并清空exc_info，这里在调用方线程中合并参数、把堆栈格式化为exc_text单独保留，
+        # JSON输出中作为独立字段，文本输出仍附加在消息之后
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self,
+                record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+
+
+# 初始化日志模块：调用方只把日志放入队列，由后台线程负责格式化后写入stderr
+_queue: queue.Queue = queue.Queue(maxsize=queue_max_size)
+_queue_handler = DroppingQueueHandler(_queue)
+_stream_handler = logging.StreamHandler(sys.stderr)
+_stream_handler.setFormatter(
+    JsonFormatter() if os.environ.get(json_output_env) == '1' else logging.Formatter(_log_format, _date_format))
+_listener = logging.handlers.QueueListener(_queue, _stream_handler, respect_handler_level=True)
+
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+for _handler in list(_root_logger.handlers):
+    _root_logger.removeHandler(_handler)
+_root_logger.addHandler(_queue_handler)
+_listener.start()
+atexit.register(_listener.stop)
+
+
 # 创建一个过滤器，根据不同的级别过滤日志
 class LevelFilter(logging.Filter):
     def __init__(self,
@@ -21,21 +96,78 @@ class LevelFilter(logging.Filter):
         return record.levelno >= self.level
 
 
+# 热点路径的日志采样与限流，WARNING及以上级别的日志总是保留
+class SamplingFilter(logging.Filter):
+    def __init__(self,
+                 name,
+                 sample_rate: typing.Optional[float] = None,
+                 max_per_second: typing.Optional[float] = None):
+        super().__init__(name)
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError('sample_rate must be between 0 and 1')
+        # 采样间隔，0表示丢弃全部INFO及以下级别的日志
+        self.sample_every = None if sample_rate is None else (0 if sample_rate == 0 else max(1, round(1 / sample_rate)))
+        self.max_per_second = max_per_second
+        self._counter = 0
+        self._tokens = max_per_second if max_per_second is not None else 0.0
+        self._last_refill = time.monotonic()
+        self._locker = threading.Lock()
+
+    def filter(self,
+               record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._locker:
+            if self.sample_every == 0:
+                return False
+            if self.sample_every is not None:
+                self._counter += 1
+                if self._counter % self.sample_every != 0:
+                    return False
+            if self.max_per_second is not None:
+                now = time.monotonic()
+                self._tokens = min(self.max_per_second,
+                                   self._tokens + (now - self._last_refill) * self.max_per_second)
+                self._last_refill = now
+                if self._tokens < 1:
+                    return False
+                self._tokens -= 1
+        return True
+
+
 class LoggerManager(object):
     def __init__(self,
                  level: int):
         self._level = level
+        # 每个logger只保留一个级别过滤器与一个采样过滤器，重复获取时更新而不是叠加
+        self._level_filters: typing.Dict[typing.Optional[str], LevelFilter] = {}
+        self._sampling_filters: typing.Dict[typing.Optional[str], SamplingFilter] = {}
+        self._locker = threading.Lock()
 
     def get_logger(self,
                    name: typing.Optional[str] = None,
-                   level: typing.Optional[int] = None) -> logging.Logger:
+                   level: typing.Optional[int] = None,
+                   sample_rate: typing.Optional[float] = None,
+                   max_per_second: typing.Optional[float] = None) -> logging.Logger:
         if name is not None:
             if type(name) is not str:
                 raise TypeError('name must be str')
         logger = logging.getLogger(name)
         level = self._level if level is None else level
-        filterer = LevelFilter(name, level)
-        logger.addFilter(filterer)
+        with self._locker:
+            filterer = self._level_filters.get(name)
+            if filterer is None:
+                filterer = LevelFilter(name, level)
+                self._level_filters[name] = filterer
+                logger.addFilter(filterer)
+            filterer.level = level
+            if sample_rate is not None or max_per_second is not None:
+                previous = self._sampling_filters.get(name)
+                if previous is not None:
+                    logger.removeFilter(previous)
+                sampling_filter = SamplingFilter(name, sample_rate=sample_rate, max_per_second=max_per_second)
+                self._sampling_filters[name] = sampling_filter
+                logger.addFilter(sampling_filter)
         logger.setLevel(level)
         return logger
 
@@ -51,6 +183,17 @@ def set_level(level: int):
     _manager.set_level(level)
 
 
+def set_json_output(enabled: bool):
+    os.environ[json_output_env] = '1' if enabled else '0'
+    _stream_handler.setFormatter(JsonFormatter() if enabled else logging.Formatter(_log_format, _date_format))
+
+
+def dropped_count() -> int:
+    return _queue_handler.dropped_count
+
+
 def get_logger(name: typing.Optional[str] = None,
-               level: typing.Optional[int] = None) -> logging.Logger:
-    return _manager.get_logger(name, level)
+               level: typing.Optional[int] = None,
+               sample_rate: typing.Optional[float] = None,
+               max_per_second: typing.Optional[float] = None) -> logging.Logger:
+    return _manager.get_logger(name, level, sample_rate, max_per_second)
@@ -1,19 +1,24 @@
+import asyncio
 import os
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-from PIL import Image
-
-from database import tables
+import profiling
+from database import tables, async_tables
 from hc_logger import logging as log_utils
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 logger = log_utils.get_logger(os.path.basename(__file__))
+# 清空照片时每个文件一条日志，限制输出频率
+file_logger = log_utils.get_logger(f"{os.path.basename(__file__)}.files", max_per_second=10)
 
 photo_base_dir = os.path.join(".", "photos")
 
 os.makedirs(photo_base_dir, exist_ok=True)
 
 
-def add_photo(photo: Image.Image,
+def add_photo(photo: 'Image.Image',
               longitude: float,
               latitude: float,
               orientation_angle: float, ) -> bool:
@@ -21,14 +26,37 @@ def add_photo(photo: Image.Image,
     if photo_id is None:
         return False
     photo_path = os.path.join(photo_base_dir, f"{photo_id}.jpg")
-    photo.save(photo_path)
+    save_photo_image(photo, photo_path)
+    return True
+
+
+async def add_photo_async(photo: 'Image.Image',
+                          longitude: float,
+                          latitude: float,
+                          orientation_angle: float, ) -> bool:
+    photo_id = await async_tables.add_photo_info(longitude=longitude, latitude=latitude,
+                                                 orientation_angle=orientation_angle)
+    if photo_id is None:
+        return False
+    photo_path = os.path.join(photo_base_dir, f"{photo_id}.jpg")
+    # 图片编码与写盘放到线程池中执行，避免阻塞事件循环
+    await asyncio.to_thread(save_photo_image, photo, photo_path)
     return True
 
 
-def get_photo_image(photo_id: int) -> Optional[Image.Image]:
+def save_photo_image(photo: 'Image.Image',
+                     photo_path: str):
+    with profiling.span("image.encode"):
+        photo.save(photo_path)
+
+
+def get_photo_image(photo_id: int) -> Optional['Image.Image']:
+    from PIL import Image
+
     photo_path = os.path.join(photo_base_dir, f"{photo_id}.jpg")
     try:
-        photo = Image.open(photo_path)
+        with profiling.span("image.open"):
+            photo = Image.open(photo_path)
         return photo
     except Exception as e:
         logger.error(e)
@@ -36,6 +64,7 @@ def get_photo_image(photo_id: int) -> Optional[Image.Image]:
 
 
 def delete_files_in_directory(directory_path):
+    deleted_count = 0
     # 遍历目录中的所有文件
     for filename in os.listdir(directory_path):
         file_path = os.path.join(directory_path, filename)
@@ -44,11 +73,13 @@ def delete_files_in_directory(directory_path):
             try:
                 # 删除文件
                 os.remove(file_path)
-                logger.info(f"已删除文件: {file_path}")
+                deleted_count += 1
+                file_logger.info("已删除文件: %s", file_path)
             except Exception as e:
                 logger.error(f"删除文件时出错: {e}")
         else:
             logger.warning(f"跳过非文件: {file_path}")
+    logger.info(f"共删除{deleted_count}个文件")
 
 
 def clear_all_photos() -> bool:
@@ -57,3 +88,11 @@ def clear_all_photos() -> bool:
         return False
     delete_files_in_directory(photo_base_dir)
     return True
+
+
+async def clear_all_photos_async() -> bool:
+    success = await async_tables.clear_all_photo_info()
+    if not success:
+        return False
+    await asyncio.to_thread(delete_files_in_directory, photo_base_dir)
+    return True
@@ -1,9 +1,12 @@
 import os
+import threading
+from typing import Optional
 
 from sqlalchemy import asc, null
 
 import analyze
 import manage_photo
+import profiling
 
 from database import core as database_core
 from database import tables
@@ -12,11 +15,37 @@ from hc_logger import logging as log_utils
 
 logger = log_utils.get_logger(os.path.basename(__file__))
 
+# 正在执行的分析任务数，用于优雅关闭时等待任务完成
+_running_job_count: int = 0
+_running_job_condition = threading.Condition()
+
+
+def running_job_count() -> int:
+    return _running_job_count
+
+
+def wait_for_running_jobs(timeout: Optional[float] = None) -> bool:
+    with _running_job_condition:
+        return _running_job_condition.wait_for(lambda: _running_job_count == 0, timeout=timeout)
+
 
 def process_all():
+    global _running_job_count
+    with _running_job_condition:
+        _running_job_count += 1
+    try:
+        return _process_all()
+    finally:
+        with _running_job_condition:
+            _running_job_count -= 1
+            _running_job_condition.notify_all()
+
+
+def _process_all():
     count, raw_list = database_core.paged_find_and_count(query_model=tables.PhotoInfo,
                                                          cond=tables.PhotoInfo.analyzed_at == null(),
-                                                         orders=[asc(tables.PhotoInfo.id)], page_size=0)
+                                                         orders=[asc(tables.PhotoInfo.id)], page_size=0,
+                                                         readonly=False)
     analyzed_photo_count: int = 0
     produced_plant_count: int = 0
     if count == 0:
@@ -24,14 +53,21 @@ def process_all():
         return analyzed_photo_count, produced_plant_count
     for photo_info in raw_list:
         photo_id = photo_info.id
+        # 同时运行的其他分析任务已认领该照片时跳过，避免重复写入植株记录
+        if not tables.claim_photo_info(photo_id):
+            logger.info(f"photo:{photo_id} claimed by another job")
+            continue
         photo_image = manage_photo.get_photo_image(photo_id)
         if photo_image is None:
             logger.error(f"photo_image:{photo_id} not found")
+            tables.release_photo_info_claim(photo_id)
             continue
-        success, analyze_results = analyze.analyze_photo(photo_image, photo_info.longitude, photo_info.latitude,
-                                                         photo_info.orientation_angle)
+        with profiling.span("analyze.analyze_photo"):
+            success, analyze_results = analyze.analyze_photo(photo_image, photo_info.longitude, photo_info.latitude,
+                                                             photo_info.orientation_angle)
         if not success:
             logger.error(f"analyze_result:{photo_id} failed")
+            tables.release_photo_info_claim(photo_id)
             continue
         analyzed_photo_count += 1
         for analyze_result in analyze_results:
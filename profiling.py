@@ -0,0 +1,208 @@
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+# 按比例自动采样请求进行性能分析，0表示只分析带有请求头的请求
+sample_rate: float = 0.0
+# 是否允许通过请求头X-Profile: 1触发单个请求的性能分析；默认关闭，需由管理员通过/admin/profiling/config开启，
+# 因为分析期间事件循环上的所有并发请求都会被计入，并且结果会写入磁盘
+header_enabled: bool = False
+profile_header: str = "x-profile"
+profile_base_dir = os.path.join(".", "profiles")
+# 最多保留的分析结果数量，超出时删除最早的结果
+max_profile_count: int = 50
+
+
+class SpanStat(object):
+    __slots__ = ('count', 'total_ms', 'max_ms')
+    count: int
+    total_ms: float
+    max_ms: float
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+_span_locker = threading.Lock()
+_span_stats: Dict[str, SpanStat] = {}
+
+
+def record_span(name: str,
+                elapsed_ms: float):
+    with _span_locker:
+        stat = _span_stats.get(name)
+        if stat is None:
+            stat = SpanStat()
+            _span_stats[name] = stat
+        stat.count += 1
+        stat.total_ms += elapsed_ms
+        if elapsed_ms > stat.max_ms:
+            stat.max_ms = elapsed_ms
+
+
+@contextlib.contextmanager
+def span(name: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, (time.perf_counter() - start_time) * 1000)
+
+
+def span_snapshot() -> List[Dict]:
+    with _span_locker:
+        return sorted([{"name": name, "count": stat.count, "total_ms": round(stat.total_ms, 3),
+                        "avg_ms": round(stat.total_ms / stat.count, 3), "max_ms": round(stat.max_ms, 3)} for
+                       name, stat in _span_stats.items()], key=lambda item: item["total_ms"], reverse=True)
+
+
+def reset_spans():
+    with _span_locker:
+        _span_stats.clear()
+
+
+def record_query_span(verb: str,
+                      elapsed_ms: float):
+    # 通过database.core.add_query_timing_hook注册，记录SQL执行耗时
+    record_span(f"db.{verb}", elapsed_ms)
+
+
+class ProfileSession(object):
+    profile: cProfile.Profile
+    thread_profiles: List[cProfile.Profile]
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        # 线程池中执行的代码不在事件循环线程上，需要单独分析后合并
+        self.thread_profiles = []
+        self._locker = threading.Lock()
+
+    def add_thread_profile(self,
+                           profile: cProfile.Profile):
+        with self._locker:
+            self.thread_profiles.append(profile)
+
+
+_current_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar("profile_session",
+                                                                                           default=None)
+# 事件循环线程上同一时间只能有一个cProfile在运行
+_profile_locker = threading.Lock()
+
+
+def should_profile(headers) -> bool:
+    if header_enabled and headers.get(profile_header) == "1":
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def start_profile() -> Optional[ProfileSession]:
+    # 分析期间事件循环上并发执行的其他请求也会被计入结果
+    if not _profile_locker.acquire(blocking=False):
+        return None
+    session = ProfileSession()
+    _current_session.set(session)
+    session.profile.enable()
+    return session
+
+
+def stop_profile(session: ProfileSession):
+    # 在事件循环线程中调用，结果由save_profile在线程池中写入
+    session.profile.disable()
+    _current_session.set(None)
+    _profile_locker.release()
+
+
+def save_profile(session: ProfileSession,
+                 label: str) -> Optional[str]:
+    try:
+        stats = pstats.Stats(session.profile)
+        for thread_profile in session.thread_profiles:
+            stats.add(thread_profile)
+        os.makedirs(profile_base_dir, exist_ok=True)
+        profile_id = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        stats.dump_stats(os.path.join(profile_base_dir, f"{profile_id}.prof"))
+        with open(os.path.join(profile_base_dir, f"{profile_id}.label"), "w", encoding="utf-8") as f:
+            f.write(label + "\n")
+        _remove_old_profiles()
+        return profile_id
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+def in_current_profile(func: Callable) -> Callable:
+    # 在事件循环线程中调用，返回的函数在线程池中执行时会被单独分析并合并到当前请求的结果中
+    session = _current_session.get()
+    if session is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            session.add_thread_profile(profile)
+
+    return wrapper
+
+
+def _remove_old_profiles():
+    profile_files = sorted(filename for filename in os.listdir(profile_base_dir) if filename.endswith(".prof"))
+    for filename in profile_files[:max(0, len(profile_files) - max_profile_count)]:
+        for suffix in (".prof", ".label"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(profile_base_dir, filename[:-len(".prof")] + suffix))
+
+
+def list_profiles() -> List[Dict]:
+    if not os.path.isdir(profile_base_dir):
+        return []
+    results = []
+    for filename in sorted(os.listdir(profile_base_dir), reverse=True):
+        if not filename.endswith(".prof"):
+            continue
+        profile_id = filename[:-len(".prof")]
+        label_path = os.path.join(profile_base_dir, f"{profile_id}.label")
+        label = ""
+        if os.path.isfile(label_path):
+            with open(label_path, encoding="utf-8") as f:
+                label = f.read().strip()
+        results.append({"profile_id": profile_id, "label": label})
+    return results
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    # 只接受由stop_profile生成的文件名，防止路径穿越
+    if os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(profile_base_dir, f"{profile_id}.prof")
+    return path if os.path.isfile(path) else None
+
+
+def profile_text(profile_id: str,
+                 limit: int = 50) -> Optional[str]:
+    path = profile_path(profile_id)
+    if path is None:
+        return None
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,62 @@
+import argparse
+import os
+from typing import List, Optional
+
+from database import core as db_core
+from database import data_version
+from database import tables
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+
+# 本地测试读写分离：FARM_DB_URL指向主库，FARM_DB_REPLICA_URLS指向副本，例如
+# FARM_DB_URL=sqlite:///primary.db FARM_DB_REPLICA_URLS=sqlite:///replica.db python replica.py seed
+# seed：在副本上创建结构并复制主库数据；check：确认只读查询分发到了各副本，并比较主库与副本的数据版本号
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="初始化本地只读副本并检查读写分离")
+    parser.add_argument("command", choices=["seed", "check"], help="seed：复制主库数据到副本；check：检查只读查询路由")
+    return parser.parse_args(argv)
+
+
+def check_routing() -> bool:
+    replica_count = len(db_core.dbEngine.replica_urls)
+    if replica_count == 0:
+        logger.error("未配置只读副本（FARM_DB_REPLICA_URLS）")
+        return False
+    with db_core.dbEngine.engine.connect() as connection:
+        primary_version = data_version.read(connection)
+    routed = True
+    # 轮询一圈，每个副本各被选中一次
+    for _ in range(replica_count):
+        with tables.read_snapshot() as snapshot:
+            bind_url = snapshot.session.get_bind().url
+            on_replica = bind_url != db_core.dbEngine.engine.url
+            logger.info(f"只读查询路由到：{bind_url.render_as_string(hide_password=True)}，"
+                        f"数据版本号：{snapshot.version}（主库：{primary_version}）")
+            routed = routed and on_replica
+    for target in db_core.dbEngine.routing_snapshot():
+        logger.info(f"{target['target']}：会话数{target['session_count']}")
+    if not routed:
+        logger.error("只读查询没有分发到副本")
+    return routed
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    db_core.dbEngine.connect()
+    try:
+        if args.command == "seed":
+            db_core.dbEngine.seed_replicas()
+        success = check_routing()
+    finally:
+        db_core.dbEngine.engine.dispose()
+        for replica_engine in db_core.dbEngine.replica_engines:
+            replica_engine.dispose()
+    if not success:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
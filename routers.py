@@ -1,20 +1,38 @@
+import asyncio
 import datetime
 import os
 import time
+from typing import Optional, Tuple
 
+import orjson
 import pydantic
-from PIL import Image
 from fastapi import FastAPI, Request, File, Form, UploadFile, APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import (get_redoc_html, get_swagger_ui_html, get_swagger_ui_oauth2_redirect_html, )
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import text
 
+import admission
 import manage_photo
 import process
+import profiling
+
+from database import async_tables
+from database import core as db_core
+from database import data_version
 from database import tables
 from hc_logger import logging as log_utils
 
 logger = log_utils.get_logger(os.path.basename(__file__))
+# 每个请求的耗时日志处于热点路径，限制每秒输出的条数
+request_log_max_per_second: float = 20
+request_logger = log_utils.get_logger(f"{os.path.basename(__file__)}.requests",
+                                      max_per_second=request_log_max_per_second)
+
+# SQL执行耗时汇总到profiling的计时统计中，通过/admin/profiling/spans查看
+db_core.add_query_timing_hook(profiling.record_query_span)
 
 # 初始化路由
 app = FastAPI(title="玉米田地管理API", docs_url=None, redoc_url=None)
@@ -26,8 +44,42 @@ app.mount("/images", StaticFiles(directory="photos"), name="images")
 origins = ["http://localhost.tiangolo.com", "https://localhost.tiangolo.com", "http://localhost",
            "http://localhost:8080", ]
 
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"],
-                   allow_headers=["*"], )
+
+# 关闭时等待分析任务完成的最长时间（秒）
+shutdown_drain_timeout: float = 300
+
+
+# 数据库连接在每个工作进程启动后建立，fork之前建立的连接不能在子进程中复用
+@app.on_event("startup")
+async def connect_database():
+    if not db_core.dbEngine.is_connected():
+        start_time = time.time()
+        await run_in_threadpool(db_core.dbEngine.connect)
+        logger.info("数据库连接完成，用时：{}毫秒".format(round(number=(time.time() - start_time) * 1000, ndigits=2)))
+
+
+@app.on_event("shutdown")
+async def drain_and_disconnect_database():
+    # uvicorn在停止接收连接并处理完进行中的请求后才触发关闭事件，此处只需等待客户端断开后仍在线程池中运行的分析任务
+    if process.running_job_count() > 0:
+        logger.info(f"等待{process.running_job_count()}个分析任务完成")
+        drained = await asyncio.to_thread(process.wait_for_running_jobs, shutdown_drain_timeout)
+        if not drained:
+            logger.warning("等待分析任务超时，强制关闭")
+    await db_core.dbEngine.async_disconnect()
+
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    if not db_core.dbEngine.is_connected():
+        return JSONResponse(status_code=503, content={"ready": False})
+    try:
+        async with db_core.dbEngine.new_async_session() as session:
+            await session.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.error(e)
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True}
 
 
 # 增加swagger资源本地化中间件
@@ -51,23 +103,162 @@ async def redoc_html():
                           redoc_js_url="/static/redoc.standalone.js", )
 
 
+# 请求准入控制：按请求分类限制并发数与排队长度，超出时立即返回429与Retry-After；
+# 响应头X-Queue-Depth为该类请求当前的排队数，现场设备可据此调整上传节奏
+@app.middleware("http")
+async def admission_control(request: Request,
+                            call_next):
+    name = admission.route_class(request.method, request.url.path)
+    if name is None:
+        return await call_next(request)
+    limiter = admission.limiters[name]
+    if not await limiter.acquire():
+        return JSONResponse(status_code=429, content={"ok": False, "description": "服务繁忙，请稍后重试"},
+                            headers={"Retry-After": str(limiter.retry_after_seconds()),
+                                     "X-Queue-Depth": str(limiter.queue_depth)})
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        limiter.release((time.perf_counter() - start_time) * 1000)
+    response.headers["X-Queue-Depth"] = str(limiter.queue_depth)
+    return response
+
+
 # 增加时间测量中间件
 @app.middleware("http")
 async def add_process_time_header(request: Request,
                                   call_next):
     start_time = time.time()
-    logger.info(f"开始处理请求：{request.url.include_query_params()}")
     response = await call_next(request)
     end_time = time.time()
-    logger.info("处理结束，用时：{}毫秒".format(round(number=(end_time - start_time) * 1000, ndigits=2)))
+    # 使用延迟格式化参数，被限流丢弃的日志不会产生格式化开销
+    request_logger.info("处理请求：%s %s，状态：%s，用时：%s毫秒", request.method, request.url.path, response.status_code,
+                        round(number=(end_time - start_time) * 1000, ndigits=2))
     return response
 
 
+# 按需性能分析：管理员开启后由请求头X-Profile: 1触发，或按采样比例触发，结果通过/admin/profiling/profiles下载
+@app.middleware("http")
+async def profile_request(request: Request,
+                          call_next):
+    if not profiling.should_profile(request.headers):
+        return await call_next(request)
+    session = profiling.start_profile()
+    if session is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.stop_profile(session)
+    # 汇总与写入结果文件放到线程池中执行，不阻塞事件循环
+    profile_id = await run_in_threadpool(profiling.save_profile, session, f"{request.method} {request.url.path}")
+    if profile_id is not None:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+# 后添加的中间件在外层：CORS放在所有中间件之外，准入控制返回的429同样带有CORS响应头，浏览器可以读取重试相关的响应头
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"],
+                   allow_headers=["*"], expose_headers=["Retry-After", "X-Queue-Depth", "X-Data-Version"], )
+
+
 class ServeStatus(pydantic.BaseModel):
     ok: bool
     description: str
 
 
+# 列表接口的快速路径：数据库返回的行按列标签（与响应模型字段同名）直接序列化为JSON字节，不再经过中间对象与pydantic校验
+def rows_json_response(rows) -> Response:
+    # union_all查询返回的列名为str的子类quoted_name，orjson只接受str作为键，先转换为普通字符串
+    fields = [str(field) for field in rows[0]._fields] if len(rows) > 0 else []
+    content = orjson.dumps({"status": {"ok": True, "description": "获取成功"}, "count": len(rows),
+                            "results": [dict(zip(fields, row)) for row in rows]})
+    return Response(content=content, media_type="application/json")
+
+
+def etag_matches(if_none_match: Optional[str],
+                 etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# 条件GET：ETag由与数据在同一会话中读取的数据版本号及当前生长季生成，二者均未变化时直接返回304，不再查询数据
+def check_not_modified(request: Request,
+                       version: int) -> Tuple[str, Optional[Response]]:
+    etag = data_version.etag(version, tables.current_season_start())
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return etag, Response(status_code=304, headers={"ETag": etag})
+    return etag, None
+
+
+# 条件GET的快速路径：本进程缓存的版本号仍在有效期内且ETag匹配时直接返回304，不打开数据库会话；
+# 未命中时再按与数据同一会话中读取的版本号判断
+def check_cached_not_modified(request: Request) -> Optional[Response]:
+    if request.headers.get("if-none-match") is None:
+        return None
+    version = data_version.cached(client_data_version(request))
+    if version is None:
+        return None
+    return check_not_modified(request, version)[1]
+
+
+def set_etag(response: Response,
+             etag: Optional[str]):
+    if etag is not None:
+        response.headers["ETag"] = etag
+
+
+# 读己之写：写入接口通过响应头X-Data-Version与Cookie返回写入后的数据版本号，客户端之后的请求带上该版本号
+# （请求头或Cookie），只读查询只使用已同步到该版本的副本，否则读主库；不同客户端与工作进程之间互不影响
+data_version_header: str = "x-data-version"
+data_version_cookie: str = "data_version"
+
+
+def client_data_version(request: Request) -> Optional[int]:
+    value = request.headers.get(data_version_header) or request.cookies.get(data_version_cookie)
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def set_client_data_version(response: Response):
+    try:
+        version = await data_version.read_primary_async()
+    except Exception as e:
+        logger.error(e)
+        return
+    response.headers["X-Data-Version"] = str(version)
+    response.set_cookie(data_version_cookie, str(version), httponly=True, samesite="lax")
+
+
+class AdmissionStatus(pydantic.BaseModel):
+    route_class: str
+    max_concurrency: int
+    max_queue: int
+    queue_timeout: float
+    running: int
+    queue_depth: int
+    admitted_count: int
+    rejected_count: int
+    retry_after: int
+
+
+class ListAdmissionStatusResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[AdmissionStatus]
+
+
+@app.get("/admission/status", response_model=ListAdmissionStatusResponse, summary="获取请求排队状态",
+         description="获取本进程中上传（ingest）、分析（analyze）与查询（read）三类请求的并发数、排队数与建议重试间隔")
+async def get_admission_status():
+    return ListAdmissionStatusResponse(status=ServeStatus(ok=True, description="获取成功"),
+                                       results=[AdmissionStatus(**item) for item in admission.status_snapshot()])
+
+
 photo_routers = APIRouter()
 
 
@@ -76,15 +267,23 @@ class UploadPhotoResponse(pydantic.BaseModel):
 
 
 @photo_routers.post("/upload", response_model=UploadPhotoResponse, summary="上传照片", description="上传照片")
-async def upload_photo(file: UploadFile = File(...),
+async def upload_photo(response: Response,
+                       file: UploadFile = File(...),
                        longitude: float = Form(...),
                        latitude: float = Form(...),
                        orientation_angle: float = Form(...), ):
     try:
+        from PIL import Image
+
         logger.info("正在解析文件：{}".format(file.filename))
-        img = Image.open(file.file).convert('RGB')
-        success = manage_photo.add_photo(img, longitude, latitude, orientation_angle)
+        def decode_image():
+            with profiling.span("image.decode"):
+                return Image.open(file.file).convert('RGB')
+
+        img = await run_in_threadpool(profiling.in_current_profile(decode_image))
+        success = await manage_photo.add_photo_async(img, longitude, latitude, orientation_angle)
         if success:
+            await set_client_data_version(response)
             return UploadPhotoResponse(status=ServeStatus(ok=True, description="上传成功"))
         else:
             return UploadPhotoResponse(status=ServeStatus(ok=False, description="上传失败"))
@@ -99,10 +298,11 @@ class ClearAllPhotosResponse(pydantic.BaseModel):
 
 @photo_routers.delete("/clear_all", response_model=ClearAllPhotosResponse, summary="清除所有照片",
                       description="清除所有照片")
-async def clear_all_photos():
+async def clear_all_photos(response: Response):
     try:
-        success = manage_photo.clear_all_photos()
+        success = await manage_photo.clear_all_photos_async()
         if success:
+            await set_client_data_version(response)
             return ClearAllPhotosResponse(status=ServeStatus(ok=True, description="删除成功"))
         else:
             return ClearAllPhotosResponse(status=ServeStatus(ok=False, description="删除失败"))
@@ -119,11 +319,26 @@ class StatPhotoCountResponse(pydantic.BaseModel):
 
 @photo_routers.get("/count_analyzed", response_model=StatPhotoCountResponse, summary="按照是否分析统计照片数量",
                    description="按照是否分析统计照片数量")
-async def stat_photo_count():
-    success, analyzed_photo_count, not_analyzed_photo_count = tables.stat_photo_info()
+async def stat_photo_count(request: Request,
+                           response: Response,
+                           include_history: bool = False):
+    not_modified = check_cached_not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    try:
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            etag, not_modified = check_not_modified(request, snapshot.version)
+            if not_modified is not None:
+                return not_modified
+            success, analyzed_photo_count, not_analyzed_photo_count = await async_tables.stat_photo_info(
+                snapshot.session, include_history=include_history)
+    except Exception as e:
+        logger.error(e)
+        success = False
     if not success:
         return StatPhotoCountResponse(status=ServeStatus(ok=False, description="统计失败"))
     else:
+        set_etag(response, etag)
         return StatPhotoCountResponse(status=ServeStatus(ok=True, description="统计成功"),
                                       analyzed_photo_count=analyzed_photo_count,
                                       not_analyzed_photo_count=not_analyzed_photo_count)
@@ -140,8 +355,11 @@ class ProcessAllUploadedPhotosResponse(pydantic.BaseModel):
 
 @analyze_routers.put("/process_all", response_model=ProcessAllUploadedPhotosResponse, summary="处理所有上传的照片",
                      description="处理所有上传的照片")
-async def process_all_uploaded_photos():
-    analyzed_photo_count, produced_plant_count = process.process_all()
+async def process_all_uploaded_photos(response: Response):
+    # 分析流程包含图片解码与同步数据库写入，放到线程池中执行
+    analyzed_photo_count, produced_plant_count = await run_in_threadpool(
+        profiling.in_current_profile(process.process_all))
+    await set_client_data_version(response)
     return ProcessAllUploadedPhotosResponse(status=ServeStatus(ok=True, description="处理完毕"),
                                             analyzed_photo_count=analyzed_photo_count,
                                             produced_plant_count=produced_plant_count)
@@ -166,16 +384,25 @@ class ListAllCornPlantInfoResponse(pydantic.BaseModel):
 
 @analyze_routers.get("/corn_plants/list_all", response_model=ListAllCornPlantInfoResponse,
                      summary="获取所有玉米植株信息", description="获取所有玉米植株信息")
-async def list_all_corn_plants_info():
-    success, count, corn_plants = tables.list_all_corn_plants_info()
-    if not success:
-        return ListAllCornPlantInfoResponse(status=ServeStatus(ok=False, description="获取失败"), count=0, results=[])
-    results = [CornPlantInfo(area_id=result.area_id, photo_id=result.photo_id, plant_height=result.plant_height,
-                             leaf_angle=result.leaf_angle, ears_height=result.ears_height,
-                             corn_plant_id=result.corn_plant_id, created_at=result.created_at,
-                             updated_at=result.updated_at) for result in corn_plants]
-    return ListAllCornPlantInfoResponse(status=ServeStatus(ok=True, description="获取成功"), count=count,
-                                        results=results)
+async def list_all_corn_plants_info(request: Request,
+                                    include_history: bool = False):
+    not_modified = check_cached_not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    try:
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            etag, not_modified = check_not_modified(request, snapshot.version)
+            if not_modified is not None:
+                return not_modified
+            success, rows = await async_tables.list_all_corn_plant_rows(snapshot.session,
+                                                                        include_history=include_history)
+        if success:
+            response = rows_json_response(rows)
+            set_etag(response, etag)
+            return response
+    except Exception as e:
+        logger.error(e)
+    return ListAllCornPlantInfoResponse(status=ServeStatus(ok=False, description="获取失败"), count=0, results=[])
 
 
 class ListCornPlantInfoByPhotoIdResponse(pydantic.BaseModel):
@@ -186,17 +413,19 @@ class ListCornPlantInfoByPhotoIdResponse(pydantic.BaseModel):
 
 @analyze_routers.get("/corn_plants/list_by_photo_id", response_model=ListCornPlantInfoByPhotoIdResponse,
                      summary="根据照片ID获取玉米植株信息", description="根据照片ID获取玉米植株信息")
-async def list_corn_plants_info_by_photo_id(photo_id: int):
-    success, count, corn_plants = tables.list_corn_plants_info_by_photo_id(photo_id=photo_id)
-    if not success:
-        return ListCornPlantInfoByPhotoIdResponse(status=ServeStatus(ok=False, description="获取失败"), count=0,
-                                                  results=[])
-    results = [CornPlantInfo(area_id=result.area_id, photo_id=result.photo_id, plant_height=result.plant_height,
-                             leaf_angle=result.leaf_angle, ears_height=result.ears_height,
-                             corn_plant_id=result.corn_plant_id, created_at=result.created_at,
-                             updated_at=result.updated_at) for result in corn_plants]
-    return ListCornPlantInfoByPhotoIdResponse(status=ServeStatus(ok=True, description="获取成功"), count=count,
-                                              results=results)
+async def list_corn_plants_info_by_photo_id(request: Request,
+                                            photo_id: int,
+                                            include_history: bool = False):
+    try:
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            success, rows = await async_tables.list_corn_plant_rows_by_photo_id(snapshot.session, photo_id=photo_id,
+                                                                                include_history=include_history)
+        if success:
+            return rows_json_response(rows)
+    except Exception as e:
+        logger.error(e)
+    return ListCornPlantInfoByPhotoIdResponse(status=ServeStatus(ok=False, description="获取失败"), count=0,
+                                              results=[])
 
 
 class StatCornPlantInfoResult(pydantic.BaseModel):
@@ -213,10 +442,21 @@ class GetStatResultOfAllAreasResponse(pydantic.BaseModel):
 
 @analyze_routers.get("/stat_by_area", response_model=GetStatResultOfAllAreasResponse, summary="按小区统计",
                      description="按小区统计")
-async def get_stat_result_of_all_areas():
+async def get_stat_result_of_all_areas(request: Request,
+                                      response: Response,
+                                      include_history: bool = False):
+    not_modified = check_cached_not_modified(request)
+    if not_modified is not None:
+        return not_modified
     try:
-        success, results = tables.stat_corn_plant_info_by_area_id()
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            etag, not_modified = check_not_modified(request, snapshot.version)
+            if not_modified is not None:
+                return not_modified
+            success, results = await async_tables.stat_corn_plant_info_by_area_id(snapshot.session,
+                                                                                  include_history=include_history)
         if success:
+            set_etag(response, etag)
             return GetStatResultOfAllAreasResponse(status=ServeStatus(ok=True, description="获取成功"), results=[
                 StatCornPlantInfoResult(area_id=result.area_id, plant_height_avg=result.plant_height_avg,
                                         leaf_angle_avg=result.leaf_angle_avg, ears_height_avg=result.ears_height_avg)
@@ -228,6 +468,103 @@ async def get_stat_result_of_all_areas():
         return GetStatResultOfAllAreasResponse(status=ServeStatus(ok=False, description="获取失败"), results=[])
 
 
+class CornPlantTrendPoint(pydantic.BaseModel):
+    area_id: str
+    bucket_start: datetime.datetime
+    plant_count: int
+    plant_height_avg: float
+    leaf_angle_avg: float
+    ears_height_avg: float
+
+
+class GetTrendOfAreasResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[CornPlantTrendPoint]
+
+
+@analyze_routers.get("/stat_by_area/timeseries", response_model=GetTrendOfAreasResponse, summary="按小区统计生长趋势",
+                     description="按时间统计各小区的平均株高、叶夹角与穗位高，"
+                                 "bucket_count为每个数据点合并的汇总桶数（默认每桶1天）")
+async def get_trend_of_areas(request: Request,
+                             response: Response,
+                             area_id: Optional[str] = None,
+                             start: Optional[datetime.datetime] = None,
+                             end: Optional[datetime.datetime] = None,
+                             bucket_count: int = 1,
+                             include_history: bool = False):
+    if bucket_count < 1:
+        return GetTrendOfAreasResponse(status=ServeStatus(ok=False, description="bucket_count必须大于0"), results=[])
+    not_modified = check_cached_not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    try:
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            etag, not_modified = check_not_modified(request, snapshot.version)
+            if not_modified is not None:
+                return not_modified
+            success, results = await async_tables.list_corn_plant_trends(snapshot.session, area_id=area_id,
+                                                                         start=start, end=end,
+                                                                         bucket_count=bucket_count,
+                                                                         include_history=include_history)
+    except Exception as e:
+        logger.error(e)
+        success = False
+    if not success:
+        return GetTrendOfAreasResponse(status=ServeStatus(ok=False, description="获取失败"), results=[])
+    set_etag(response, etag)
+    return GetTrendOfAreasResponse(status=ServeStatus(ok=True, description="获取成功"), results=[
+        CornPlantTrendPoint(area_id=result.area_id, bucket_start=result.bucket_start, plant_count=result.plant_count,
+                            plant_height_avg=result.plant_height_avg, leaf_angle_avg=result.leaf_angle_avg,
+                            ears_height_avg=result.ears_height_avg) for result in results])
+
+
+class MetricDistribution(pydantic.BaseModel):
+    p10: Optional[float]
+    p50: Optional[float]
+    p90: Optional[float]
+    histogram_edges: list[float]
+    histogram_counts: list[int]
+
+
+class AreaDistribution(pydantic.BaseModel):
+    area_id: str
+    plant_count: int
+    plant_height: MetricDistribution
+    leaf_angle: MetricDistribution
+    ears_height: MetricDistribution
+
+
+class GetDistributionOfAreasResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[AreaDistribution]
+
+
+@analyze_routers.get("/stat_by_area/distribution", response_model=GetDistributionOfAreasResponse,
+                     summary="按小区统计分布", description="按小区统计株高、叶夹角与穗位高的分位数（p10/p50/p90）与直方图")
+async def get_distribution_of_areas(request: Request,
+                                    response: Response,
+                                    include_history: bool = False):
+    import stat_distribution
+
+    not_modified = check_cached_not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    # 读取与计算均为同步操作，放到线程池中执行；结果在数据版本号变化前会被缓存，命中缓存时只读取版本号
+    success, version, results = await run_in_threadpool(stat_distribution.get_area_distributions, include_history,
+                                                        client_data_version(request))
+    if not success:
+        return GetDistributionOfAreasResponse(status=ServeStatus(ok=False, description="获取失败"), results=[])
+    etag, not_modified = check_not_modified(request, version)
+    if not_modified is not None:
+        return not_modified
+    set_etag(response, etag)
+    return GetDistributionOfAreasResponse(status=ServeStatus(ok=True, description="获取成功"), results=[
+        AreaDistribution(area_id=result.area_id, plant_count=result.plant_count, **{
+            name: MetricDistribution(p10=metric.p10, p50=metric.p50, p90=metric.p90,
+                                     histogram_edges=metric.histogram_edges, histogram_counts=metric.histogram_counts)
+            for name, metric in result.metrics.items()}) for result in results])
+
+
 class RelatedPhotoInfo(pydantic.BaseModel):
     photo_id: int
     longitude: float
@@ -246,21 +583,169 @@ class ListAllAreaInvolvedPhotosResponse(pydantic.BaseModel):
 
 @analyze_routers.get("/area/involved_photos/list", response_model=ListAllAreaInvolvedPhotosResponse,
                      summary="获取所有地区相关照片信息", description="获取所有地区相关照片")
-async def list_all_area_involved_photos(area_id: str):
+async def list_all_area_involved_photos(request: Request,
+                                        area_id: str,
+                                        include_history: bool = False):
     if area_id is None or area_id == "":
         return ListAllAreaInvolvedPhotosResponse(status=ServeStatus(ok=False, description="地区id为空"), count=0,
                                                  results=[])
-    success, count, related_photos = tables.list_photo_info_by_area_id(area_id=area_id)
-    if not success:
-        return ListAllAreaInvolvedPhotosResponse(status=ServeStatus(ok=False, description="获取失败"), count=0,
-                                                 results=[])
-    results = [RelatedPhotoInfo(photo_id=result.photo_id, longitude=result.longitude, latitude=result.latitude,
-                                orientation_angle=result.orientation_angle, analyzed_at=result.analyzed_at,
-                                created_at=result.created_at, updated_at=result.updated_at) for result in
-               related_photos]
-    return ListAllAreaInvolvedPhotosResponse(status=ServeStatus(ok=True, description="获取成功"), count=count,
-                                             results=results)
+    try:
+        async with async_tables.read_snapshot(client_data_version(request)) as snapshot:
+            success, rows = await async_tables.list_photo_rows_by_area_id(snapshot.session, area_id=area_id,
+                                                                          include_history=include_history)
+        if success:
+            return rows_json_response(rows)
+    except Exception as e:
+        logger.error(e)
+    return ListAllAreaInvolvedPhotosResponse(status=ServeStatus(ok=False, description="获取失败"), count=0,
+                                             results=[])
+
+
+admin_routers = APIRouter()
+
+
+class ProfilingConfig(pydantic.BaseModel):
+    sample_rate: float
+    header_enabled: bool
+
+
+class GetProfilingConfigResponse(pydantic.BaseModel):
+    status: ServeStatus
+    config: ProfilingConfig
+
+
+@admin_routers.put("/profiling/config", response_model=GetProfilingConfigResponse, summary="设置性能分析采样",
+                   description="设置自动采样分析的请求比例，以及是否允许通过请求头X-Profile: 1触发分析")
+async def set_profiling_config(config: ProfilingConfig):
+    if not 0 <= config.sample_rate <= 1:
+        return GetProfilingConfigResponse(status=ServeStatus(ok=False, description="采样比例必须在0到1之间"),
+                                          config=ProfilingConfig(sample_rate=profiling.sample_rate,
+                                                                 header_enabled=profiling.header_enabled))
+    profiling.sample_rate = config.sample_rate
+    profiling.header_enabled = config.header_enabled
+    return GetProfilingConfigResponse(status=ServeStatus(ok=True, description="设置成功"), config=config)
+
+
+class SpanInfo(pydantic.BaseModel):
+    name: str
+    count: int
+    total_ms: float
+    avg_ms: float
+    max_ms: float
+
+
+class ListSpansResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[SpanInfo]
+
+
+@admin_routers.get("/profiling/spans", response_model=ListSpansResponse, summary="获取耗时统计",
+                   description="获取本进程中数据库、图片解码与照片分析等环节的累计耗时")
+async def list_spans():
+    return ListSpansResponse(status=ServeStatus(ok=True, description="获取成功"),
+                             results=[SpanInfo(**span) for span in profiling.span_snapshot()])
+
+
+@admin_routers.delete("/profiling/spans", response_model=ListSpansResponse, summary="重置耗时统计",
+                      description="重置耗时统计")
+async def reset_spans():
+    profiling.reset_spans()
+    return ListSpansResponse(status=ServeStatus(ok=True, description="重置成功"), results=[])
+
+
+class ProfileInfo(pydantic.BaseModel):
+    profile_id: str
+    label: str
+
+
+class ListProfilesResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[ProfileInfo]
+
+
+@admin_routers.get("/profiling/profiles", response_model=ListProfilesResponse, summary="获取性能分析结果列表",
+                   description="获取性能分析结果列表")
+async def list_profiles():
+    results = await run_in_threadpool(profiling.list_profiles)
+    return ListProfilesResponse(status=ServeStatus(ok=True, description="获取成功"),
+                                results=[ProfileInfo(**result) for result in results])
+
+
+@admin_routers.get("/profiling/profiles/{profile_id}", summary="下载性能分析结果",
+                   description="下载cProfile结果文件（可用pstats或snakeviz打开），format=text时返回按累计耗时排序的文本")
+async def download_profile(profile_id: str,
+                           format: str = "prof"):
+    if format == "text":
+        text = await run_in_threadpool(profiling.profile_text, profile_id)
+        if text is None:
+            return JSONResponse(status_code=404, content={"ok": False, "description": "分析结果不存在"})
+        return PlainTextResponse(text)
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"ok": False, "description": "分析结果不存在"})
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+
+class DBRoutingTarget(pydantic.BaseModel):
+    target: str
+    replica: bool
+    session_count: int
+
+
+class ListDBRoutingResponse(pydantic.BaseModel):
+    status: ServeStatus
+    results: list[DBRoutingTarget]
+
+
+@admin_routers.get("/db/routing", response_model=ListDBRoutingResponse, summary="获取读写分离统计",
+                   description="获取本进程中主库与各只读副本上创建的会话数，用于确认只读查询确实分发到了副本")
+async def list_db_routing():
+    return ListDBRoutingResponse(status=ServeStatus(ok=True, description="获取成功"),
+                                 results=[DBRoutingTarget(**target) for target in db_core.dbEngine.routing_snapshot()])
+
+
+class AdmissionConfig(pydantic.BaseModel):
+    max_concurrency: int
+    max_queue: int
+    queue_timeout: float
+
+
+@admin_routers.put("/admission/{route_class}", response_model=ListAdmissionStatusResponse, summary="设置请求准入限制",
+                   description="设置ingest、analyze或read类请求的最大并发数、最大排队数与排队超时（秒）")
+async def set_admission_config(route_class: str,
+                               config: AdmissionConfig):
+    if config.max_concurrency < 1 or config.max_queue < 0 or config.queue_timeout < 0:
+        return ListAdmissionStatusResponse(status=ServeStatus(ok=False, description="并发数必须大于0，排队数与超时不能为负"),
+                                           results=[AdmissionStatus(**item) for item in admission.status_snapshot()])
+    if not admission.configure(route_class, config.max_concurrency, config.max_queue, config.queue_timeout):
+        return ListAdmissionStatusResponse(status=ServeStatus(ok=False, description="请求分类不存在"),
+                                           results=[AdmissionStatus(**item) for item in admission.status_snapshot()])
+    return ListAdmissionStatusResponse(status=ServeStatus(ok=True, description="设置成功"),
+                                       results=[AdmissionStatus(**item) for item in admission.status_snapshot()])
+
+
+class ArchiveRequest(pydantic.BaseModel):
+    before: Optional[datetime.datetime] = None
+
+
+class ArchiveResponse(pydantic.BaseModel):
+    status: ServeStatus
+    photo_count: int
+    corn_plant_count: int
+
+
+@admin_routers.put("/archive", response_model=ArchiveResponse, summary="归档往季数据",
+                   description="将before（默认为当前生长季开始时间）之前上传的照片及其玉米植株分批移入归档表，"
+                               "查询接口指定include_history=true时仍可查询归档数据")
+async def archive_photos(archive_request: ArchiveRequest,
+                         response: Response):
+    cutoff = archive_request.before if archive_request.before is not None else tables.current_season_start()
+    success, photo_count, corn_plant_count = await run_in_threadpool(tables.archive_photo_info_before, cutoff)
+    await set_client_data_version(response)
+    return ArchiveResponse(status=ServeStatus(ok=success, description="归档完毕" if success else "归档失败"),
+                           photo_count=photo_count, corn_plant_count=corn_plant_count)
 
 
 app.include_router(photo_routers, prefix="/photos", tags=["照片管理"], )
 app.include_router(analyze_routers, prefix="/analyze", tags=["分析管理"], )
+app.include_router(admin_routers, prefix="/admin", tags=["运维管理"], )
@@ -1,9 +1,26 @@
-import uvicorn
+import importlib.util
+import os
+from typing import Optional
 
-import routers
+import uvicorn
 
 port: int = 9001
 
 
 def run_server():
+    import routers
+
     uvicorn.run(routers.app, host="0.0.0.0", port=port)
+
+
+def run_production_server(workers: Optional[int] = None):
+    # 多进程模式下uvicorn需要以导入字符串的形式加载应用，每个工作进程各自导入并在启动事件中连接数据库
+    from database import core as db_core
+
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    # 迁移只在主进程中执行一次，避免多个工作进程同时建表或重复执行迁移
+    db_core.dbEngine.prepare_schema()
+    loop = "uvloop" if importlib.util.find_spec("uvloop") is not None else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") is not None else "h11"
+    uvicorn.run("routers:app", host="0.0.0.0", port=port, workers=workers, loop=loop, http=http,
+                access_log=False)
@@ -0,0 +1,170 @@
+import datetime
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database import tables
+from hc_logger import logging as log_utils
+
+logger = log_utils.get_logger(os.path.basename(__file__))
+
+metric_names: Tuple[str, ...] = ("plant_height", "leaf_angle", "ears_height")
+quantile_levels: Tuple[float, ...] = (0.1, 0.5, 0.9)
+histogram_bin_count: int = 10
+# 流式读取时每批的行数
+fetch_batch_size: int = 100000
+
+
+class MetricDistribution(object):
+    __slots__ = ('p10', 'p50', 'p90', 'histogram_edges', 'histogram_counts')
+    p10: Optional[float]
+    p50: Optional[float]
+    p90: Optional[float]
+    histogram_edges: List[float]
+    histogram_counts: List[int]
+
+    def __init__(self,
+                 p10: Optional[float],
+                 p50: Optional[float],
+                 p90: Optional[float],
+                 histogram_edges: List[float],
+                 histogram_counts: List[int]):
+        self.p10: Optional[float] = p10
+        self.p50: Optional[float] = p50
+        self.p90: Optional[float] = p90
+        self.histogram_edges: List[float] = histogram_edges
+        self.histogram_counts: List[int] = histogram_counts
+
+
+class AreaDistributionResult(object):
+    __slots__ = ('area_id', 'plant_count', 'metrics')
+    area_id: str
+    plant_count: int
+    metrics: Dict[str, MetricDistribution]
+
+    def __init__(self,
+                 area_id: str,
+                 plant_count: int,
+                 metrics: Dict[str, MetricDistribution]):
+        self.area_id: str = area_id
+        self.plant_count: int = plant_count
+        self.metrics: Dict[str, MetricDistribution] = metrics
+
+
+def load_measurements(session,
+                      include_history: bool = False) -> Tuple[List[str], np.ndarray, Dict[str, np.ndarray]]:
+    # 一次流式扫描读取所有测量值：小区编号转换为整数编码，测量值放入float64数组（NULL为NaN）
+    area_codes: Dict[str, int] = {}
+    code_chunks: List[np.ndarray] = []
+    value_chunks: Dict[str, List[np.ndarray]] = {name: [] for name in metric_names}
+    # 列顺序与metric_names一致
+    qry = tables.measurement_query(include_history)
+    result = session.execute(qry.execution_options(yield_per=fetch_batch_size))
+    for partition in result.partitions():
+        columns = list(zip(*partition))
+        code_chunks.append(np.fromiter((area_codes.setdefault(area_id, len(area_codes))
+                                        for area_id in columns[0]), dtype=np.int64, count=len(partition)))
+        for index, name in enumerate(metric_names):
+            value_chunks[name].append(np.array(columns[index + 1], dtype=np.float64))
+    area_names = list(area_codes)
+    codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int64)
+    values = {name: np.concatenate(chunks) if chunks else np.empty(0, dtype=np.float64) for name, chunks in
+              value_chunks.items()}
+    return area_names, codes, values
+
+
+def grouped_quantiles(codes: np.ndarray,
+                      values: np.ndarray,
+                      group_count: int,
+                      levels: Tuple[float, ...]) -> np.ndarray:
+    # 按(小区, 数值)排序后，各小区的数据在数组中连续且有序，直接按位置线性插值求分位数
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    last = np.maximum(counts - 1, 0)
+    quantiles = np.full((len(levels), group_count), np.nan)
+    non_empty = counts > 0
+    for index, level in enumerate(levels):
+        position = level * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        lower_values = sorted_values[(starts + lower)[non_empty]]
+        upper_values = sorted_values[(starts + upper)[non_empty]]
+        quantiles[index, non_empty] = lower_values + (upper_values - lower_values) * fraction[non_empty]
+    return quantiles
+
+
+def grouped_histograms(codes: np.ndarray,
+                       values: np.ndarray,
+                       group_count: int,
+                       bin_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    # 所有小区共用同一组分箱边界，便于横向比较
+    if len(values) == 0:
+        return np.zeros(bin_count + 1), np.zeros((group_count, bin_count), dtype=np.int64)
+    edges = np.linspace(values.min(), values.max(), bin_count + 1)
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bin_count - 1)
+    counts = np.bincount(codes * bin_count + bins, minlength=group_count * bin_count)
+    return edges, counts.reshape(group_count, bin_count)
+
+
+def compute_area_distributions(area_names: List[str],
+                               codes: np.ndarray,
+                               values: Dict[str, np.ndarray]) -> List[AreaDistributionResult]:
+    group_count = len(area_names)
+    if group_count == 0:
+        return []
+    plant_counts = np.bincount(codes, minlength=group_count)
+    metric_results: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+    for name in metric_names:
+        valid = ~np.isnan(values[name])
+        metric_codes = codes[valid]
+        metric_values = values[name][valid]
+        quantiles = grouped_quantiles(metric_codes, metric_values, group_count, quantile_levels)
+        edges, histograms = grouped_histograms(metric_codes, metric_values, group_count, histogram_bin_count)
+        metric_results[name] = (quantiles, edges, histograms)
+    results: List[AreaDistributionResult] = []
+    for group, area_id in enumerate(area_names):
+        metrics: Dict[str, MetricDistribution] = {}
+        for name, (quantiles, edges, histograms) in metric_results.items():
+            p10, p50, p90 = [None if np.isnan(value) else float(value) for value in quantiles[:, group]]
+            metrics[name] = MetricDistribution(p10=p10, p50=p50, p90=p90, histogram_edges=edges.tolist(),
+                                               histogram_counts=histograms[group].tolist())
+        results.append(AreaDistributionResult(area_id=area_id, plant_count=int(plant_counts[group]), metrics=metrics))
+    results.sort(key=lambda result: result.area_id)
+    return results
+
+
+# 结果按(是否包含历史数据, 当前生长季)缓存，并记录计算时所读数据的版本号；版本号变化或换季后重新计算
+_cache_locker = threading.Lock()
+_cached_results: Dict[Tuple[bool, datetime.datetime], Tuple[int, List[AreaDistributionResult]]] = {}
+
+
+def clear_cache():
+    with _cache_locker:
+        _cached_results.clear()
+
+
+def get_area_distributions(include_history: bool = False,
+                           min_version: Optional[int] = None
+                           ) -> Tuple[bool, Optional[int], List[AreaDistributionResult]]:
+    # 返回结果对应的数据版本号，版本号与测量值在同一会话中读取，副本延迟时不会把旧数据记到新版本号下
+    with _cache_locker:
+        try:
+            key = (include_history, tables.current_season_start())
+            # 只读扫描使用独立的会话，不持有写入共用的dbEngine.locker，缓存未命中时的长时间扫描不会阻塞分析与归档写入
+            with tables.read_snapshot(min_version) as snapshot:
+                version = snapshot.version
+                cached = _cached_results.get(key)
+                if cached is not None and cached[0] == version:
+                    return True, version, cached[1]
+                area_names, codes, values = load_measurements(snapshot.session, include_history)
+            results = compute_area_distributions(area_names, codes, values)
+        except Exception as e:
+            logger.error(e)
+            return False, None, []
+        _cached_results[key] = (version, results)
+        return True, version, results